@@ -0,0 +1,58 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time formatting synthetic sections with each section formatter.
+Each section has every type of requirement, seven commands (including log messages), limits, an option and a hold.
+The SHA-256 of the formatted output is reported, so that the output of two source trees can be compared"""
+
+import hashlib
+from benchutils import newParser, parseArgs, bestTime
+
+# The requirement types given to every section:
+requirement_types = ['PATH_ABSENT', 'PATH_PRESENT', 'PATH_READABLE', 'PATH_WRITABLE', 'PATH_EXECUTABLE', 'ENV_SET', 'ENV_UNSET']
+
+# A function to create a SectionList of synthetic sections:
+def syntheticSections(qssections, count):
+    section_list = qssections.SectionList()
+    for i in range(count):
+        section_list.newSection('job_{}'.format(i), description='job {}'.format(i), check=(i % 2 == 0), log=(i % 3 != 0))
+        section = section_list.latest
+        section.limits['h_rt'] = '1:00:00'
+        section.limits['h_vmem'] = '4G'
+        section.options.append(qssections.Option.fromString('-V'))
+        section.holds.append('prev_{}'.format(i))
+        for requirement in requirement_types: section.requirements.append('/data/{}'.format(i), requirement)
+        section.outfile.path = '/tmp/logs'
+        section.errfile.path = '/tmp/logs'
+        for j in range(5): section.commands.newCommand(cmd='run {} {}'.format(i, j), name='step{}'.format(j), test=(j % 2 == 0), log=(j != 3), cmdtype=qssections.CommandType.command)
+        section.commands.newCommand(cmd='hello', name=None, test=False, log=False, cmdtype=qssections.CommandType.log_out)
+        section.commands.newCommand(cmd='warning', name=None, test=False, log=False, cmdtype=qssections.CommandType.log_err)
+    return section_list
+
+def main():
+    parser = newParser('Time formatting synthetic sections')
+    parser.add_argument('--sections', metavar='N', type=int, default=10000, help='the number of sections to format (default 10000)')
+    parser.add_argument('--formats', metavar='name', nargs='+', default=['bash', 'qsub', 'bsub'], choices=['bash', 'qsub', 'bsub', 'slurm', 'pbs'], help='the formats to time (default bash qsub bsub; slurm and pbs are not in older trees)')
+    args = parseArgs(parser)
+    import qsubsec.sections as qssections
+    import qsubsec.sectionFormatter as qsformatter
+    formatters = {'bash':'BashFormatter', 'qsub':'QSUBFormatter', 'bsub':'LSFFormatter', 'slurm':'SlurmFormatter', 'pbs':'PBSFormatter'}
+    section_list = syntheticSections(qssections, args.sections)
+    print('{:>6} {:>9} {:>10}  {}'.format('format', 'sections', 'seconds', 'sha256'))
+    for name in args.formats:
+        formatter = getattr(qsformatter, formatters[name])
+        elapsed, output = bestTime(lambda: [formatter.newline.join(formatter.format(section)) for section in section_list], args.repeat)
+        output_hash = hashlib.sha256('\0'.join(output).encode('UTF-8')).hexdigest()
+        print('{:>6} {:>9} {:>10.3f}  {}'.format(name, args.sections, elapsed, output_hash[:16]))
+
+if __name__ == '__main__': main()
@@ -0,0 +1,45 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time TokenSet resolution as the depth and number of dependency chains grow.
+Each chain hangs off one iterated token (so every token is resolved once per combination), and each link refers to the previous one"""
+
+from benchutils import newParser, parseArgs, bestTime
+
+# A function to create a TokenSet of width chains of depth tokens, each starting from an iterated token with the given number of values:
+def chainTokenSet(qstokens, depth, width, values):
+    token_set = qstokens.TokenSet()
+    token_set.add(qstokens.Token('S', ['s{}'.format(i) for i in range(values)]))
+    for w in range(width):
+        previous = 'S'
+        for d in range(depth):
+            name = 'T{}_{}'.format(w, d)
+            token_set.add(qstokens.Token(name, ['{{{}}}/x'.format(previous)]))
+            previous = name
+    return token_set
+
+def main():
+    parser = newParser('Time TokenSet resolution for chains of dependent tokens')
+    parser.add_argument('--depths', metavar='N', type=int, nargs='+', default=[5, 20, 40], help='the chain depths to time (default 5 20 40)')
+    parser.add_argument('--widths', metavar='N', type=int, nargs='+', default=[1, 10], help='the numbers of chains to time (default 1 10)')
+    parser.add_argument('--values', metavar='N', type=int, default=20, help='the number of values of the iterated token, and so of combinations (default 20)')
+    args = parseArgs(parser)
+    import qsubsec.tokens as qstokens
+    print('{:>6} {:>7} {:>13} {:>10}'.format('depth', 'tokens', 'combinations', 'seconds'))
+    for depth in args.depths:
+        for width in args.widths:
+            token_set = chainTokenSet(qstokens, depth, width, args.values)
+            elapsed, resolved = bestTime(lambda: token_set.resolve(), args.repeat)
+            print('{:>6} {:>7} {:>13} {:>10.3f}'.format(depth, len(token_set.names), len(resolved), elapsed))
+
+if __name__ == '__main__': main()
@@ -0,0 +1,48 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time parsing synthetic TFF files of increasing length.
+The files are 70% chained path assignments, 10% assignments with templated names, 10% iterated values and 10% comments"""
+
+import random
+from benchutils import newParser, parseArgs, bestTime
+
+# A function to generate a synthetic TFF string with the given number of lines (the same for a given seed):
+def syntheticTFF(lines, seed=0):
+    generator = random.Random(seed)
+    output = ['ROOT = /data', 'SAMPLE = s1, s2, s3', 'T0 = "{ROOT}/x"']
+    paths = [0]
+    for i in range(3, lines):
+        r = generator.random()
+        if r < 0.7:
+            output.append('T{} = "{{ROOT}}/path{}/{{T{}}}"'.format(i, i, generator.choice(paths)))
+            paths.append(i)
+        elif r < 0.8: output.append('"N_{{T{}}}_{}" = v{} # named'.format(generator.choice(paths), i, i))
+        elif r < 0.9: output.append('# comment {}'.format(i))
+        else: output.append('Q{} = a{}, b{}, "{{SAMPLE}}"'.format(i, i, i))
+    return '\n'.join(output)
+
+def main():
+    parser = newParser('Time parsing synthetic TFF files')
+    parser.add_argument('--lines', metavar='N', type=int, nargs='+', default=[1000, 10000], help='the TFF file lengths to time (default 1000 10000)')
+    parser.add_argument('--parser', dest='tff_parser', default='pyparsing', choices=['pyparsing', 'line'], help='the TFF parser to time (default pyparsing; the line parser is not in older trees)')
+    args = parseArgs(parser)
+    import qsubsec.tokens as qstokens
+    parser_class = qstokens.TFFParser if args.tff_parser == 'pyparsing' else qstokens.TFFLineParser
+    print('{:>8} {:>8} {:>10}'.format('lines', 'tokens', 'seconds'))
+    for lines in args.lines:
+        tff = syntheticTFF(lines)
+        elapsed, token_set = bestTime(lambda: parser_class().parseString(tff), args.repeat)
+        print('{:>8} {:>8} {:>10.3f}'.format(lines, len(token_set.names), elapsed))
+
+if __name__ == '__main__': main()
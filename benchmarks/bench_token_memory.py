@@ -0,0 +1,42 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the memory (using tracemalloc) and time taken to store the values of a large iterated token.
+Each value refers to other tokens, as in '{BASE}/sample_0000001/{RUN}.bam'"""
+
+import gc
+import tracemalloc
+from benchutils import newParser, parseArgs, bestTime
+
+def main():
+    parser = newParser('Measure the memory used by the values of a large iterated token')
+    parser.add_argument('--values', metavar='N', type=int, nargs='+', default=[100000], help='the numbers of token values to measure (default 100000)')
+    parser.add_argument('--literal', action='store_true', default=False, help='use values without token references')
+    args = parseArgs(parser)
+    import qsubsec.tokens as qstokens
+    value_format = '/data/sample_{:07d}/run.bam' if args.literal is True else '{{BASE}}/sample_{:07d}/{{RUN}}.bam'
+    print('{:>9} {:>10} {:>8} {:>14}'.format('values', 'seconds', 'MB', 'bytes/value'))
+    for n in args.values:
+        values = [value_format.format(i) for i in range(n)]
+        elapsed, token = bestTime(lambda: qstokens.Token('S', values), args.repeat)
+        del token
+        # Measure the memory held by a single token, once the timed tokens have been freed:
+        gc.collect()
+        tracemalloc.start()
+        token = qstokens.Token('S', values)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del token
+        print('{:>9} {:>10.3f} {:>8.1f} {:>14.0f}'.format(n, elapsed, size / 1e6, size / n))
+
+if __name__ == '__main__': main()
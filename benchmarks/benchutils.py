@@ -0,0 +1,45 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Shared command line handling and timing for the qsubsec benchmarks"""
+
+import argparse
+import os
+import os.path
+import sys
+import time
+
+# A function to create a benchmark command line parser.
+# NB: --tree selects the qsubsec source tree to import, so that (for example) a checkout of an earlier commit can be compared with this one:
+def newParser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--tree', metavar='path', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the qsubsec source tree to benchmark (default: the tree containing this script)')
+    parser.add_argument('-r', '--repeat', metavar='N', type=int, default=3, help='report the best of N runs (default 3)')
+    return parser
+
+# A function to parse the benchmark arguments, and make the requested qsubsec tree importable:
+def parseArgs(parser):
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(args.tree))
+    return args
+
+# A function to return the shortest wall time (in seconds) of repeated calls to function, along with the result of the last call:
+def bestTime(function, repeat=3):
+    best = None
+    result = None
+    for i in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best): best = elapsed
+    return best, result
@@ -12,19 +12,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import qsubsec.tokens as qstokens
-from qsubsec.sections import SectionList, Limits, CommandType
+from qsubsec.sections import SectionList, Limits, CommandType, HoldList, iterSectionJSON
 from qsubsec.templates import Template
-from qsubsec.sectionSubmitter import outputSubmitterProc, outputSubmitterShell
+from qsubsec.urlFetcher import URLFetcher, setDefaultFetcher
+from qsubsec.sectionSubmitter import outputSubmitterAsync, outputSubmitterAsyncShell, outputSubmitterSlurm, outputSubmitterPBS, SubmissionPool, SkippedSectionError, SubmissionJournal
 import qsubsec.sectionFormatter 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from itertools import groupby
+from fnmatch import fnmatchcase
+from operator import itemgetter
 import os
 import os.path
 import logging
 import argparse
 import json
 import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from math import floor, log10
 from sys import exit, stdin, stdout, exc_info
+from contextlib import contextmanager
 import re
 from signal import signal, SIGPIPE, SIG_DFL
 from pyparsing import *
@@ -34,6 +40,9 @@ from urllib.parse import urlparse
 version = {}
 with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
 
+# The available TFF parsers:
+tff_parsers = OrderedDict([('line', qstokens.TFFLineParser), ('pyparsing', qstokens.TFFParser)])
+
 # A function to quit with an error:
 def error(log, msg, exit_code=1):
     log.error(msg)
@@ -66,9 +75,215 @@ def loadRCFile(filename=None):
     except: ns = argparse.Namespace()
     return ns
     
+# A function to parse a single token source (a file, URL or TFF string) using a new parser:
+# NB: This is a module-level function so that it can be run in a process pool
+def parseTokenSource(parser_class, parser_kwargs, source):
+    tsp = parser_class(**parser_kwargs)
+    if isURL(source): return tsp.parseURL(source)
+    if os.path.exists(source): return tsp.parse(os.path.realpath(source))
+    return tsp.parseString(source)
+
+# A function to parse token sources concurrently, yielding (source, future) pairs in command-line order:
+# NB: URLs are read in a thread pool. Files are read in the same thread pool or, if processes is True, in a process pool.
+def parseTokenSources(log, sources, parser_class, parser_kwargs, jobs=1, processes=False):
+    def completed(function, *args):
+        future = Future()
+        try: future.set_result(function(*args))
+        except BaseException as err: future.set_exception(err)
+        return future
+    thread_pool = None
+    process_pool = None
+    if jobs > 1:
+        thread_pool = ThreadPoolExecutor(max_workers=jobs)
+        if processes is True: process_pool = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        futures = []
+        for source in sources:
+            if source == '-':
+                log.info('reading tokens from stdin')
+                futures.append((source, completed(parser_class(**parser_kwargs).parseHandle, stdin)))
+                continue
+            if isURL(source):
+                log.info('reading tokens from URL {}'.format(source))
+                pool = thread_pool
+            elif os.path.exists(source):
+                log.info('reading tokens from file {}'.format(os.path.realpath(source)))
+                pool = process_pool or thread_pool
+            else:
+                log.info('reading tokens from command line "{}"'.format(source))
+                pool = None
+            if pool is None: futures.append((source, completed(parseTokenSource, parser_class, parser_kwargs, source)))
+            else: futures.append((source, pool.submit(parseTokenSource, parser_class, parser_kwargs, source)))
+        for source_future in futures: yield source_future
+    finally:
+        for pool in (thread_pool, process_pool):
+            if pool is not None: pool.shutdown(cancel_futures=True)
+
+# A function to limit the commands included in each of a stream of (combination, section) pairs:
+def iterFilteredSections(log, sections, filter_commands=None, first_command=None, last_command=None):
+    # Compile the regular expression:
+    if filter_commands is not None:
+        try:
+            if filter_commands.startswith('!'):
+                filter_commands = filter_commands.lstrip('!')
+                log.info('inverting regular expression "{}"'.format(filter_commands))
+                invert = True
+            else: invert = False
+            log.info('filtering commands with regular expression "{}"'.format(filter_commands))
+            command_re = re.compile(filter_commands)
+        except: error(log, 'failed to parse the regular expression ({})'.format(filter_commands))
+    for combination, section in sections:
+        # If specified, turn off preceeding commands:
+        if first_command is not None:
+            if first_command not in section.commands.names: log.warning('invalid first command specified ({}); no commands will be selected'.format(first_command))
+            for cmd in section.commands:
+                if cmd.cmdtype != CommandType.command: continue
+                if cmd.name == first_command: break
+                cmd.include = False
+        # If specified, turn off subsequent commands:
+        if last_command is not None:
+            if last_command not in section.commands.names: log.warning('invalid last command specified ({}); no commands will be selected'.format(last_command))
+            for i in range(len(section.commands)):
+                cmd = section.commands[-i] # Iterate backwards
+                if cmd.cmdtype != CommandType.command: continue
+                if cmd.name == last_command: break
+                cmd.include = False
+        # If specified, limit to commands matching regular expression:
+        if filter_commands is not None:
+            for cmd in section.commands:
+                if cmd.cmdtype != CommandType.command: continue
+                match = command_re.match(cmd.name)
+                if ((match is None) and (invert is False)) or ((match is not None) and (invert is True)):
+                    cmd.include = False
+        yield combination, section
+
+# A function to number a stream of (combination, section) pairs, yielding (i, N, section) for an [i/N] progress display.
+# NB: Sections are submitted as they are generated, so N is estimated from the number of sections per combination so far:
+def iterSectionProgress(sections, combinations):
+    i = 0
+    for combination, group in groupby(sections, key=itemgetter(0)):
+        group = [section for c, section in group]
+        total = max(round((i + len(group)) * combinations / (combination + 1)), i + len(group))
+        for section in group:
+            i += 1
+            yield i, total, section
+
+# A function to group a stream of (i, N, section) items into batches of up to batch_size sections, yielding (name, items) pairs in submission order.
+# Sections with the same formatter arrayKey are batched together, and can be submitted as a single task array named after the first section in the batch.
+# Batches are submitted in the order of their first sections, so a section only joins an open batch if none of the sections matching its holds are in that batch or a later one.
+# Otherwise, the open batch is closed and the section starts a new batch.
+# NB: Holds on batched sections are rewritten to the task array containing them, so that no batch can hold on a later batch.
+# Wildcard holds are kept, with the task arrays containing matching sections added when the array name does not match the hold itself:
+def iterSectionBatches(log, sections, formatter, batch_size):
+    arrays = {}
+    array_holds = {}
+    batches = OrderedDict()
+    open_batches = {}
+    positions = {}
+    patterns = {}
+    buffered = 0
+    # A function to determine if any of a set of holds match a section buffered in a batch (or a later batch).
+    # NB: The last batch containing a section matching each wildcard hold is updated as sections are added, rather than searching the buffered sections each time:
+    def holdsFrom(holds, batch):
+        for hold in holds:
+            if any([c in hold for c in '*?[']):
+                if hold not in patterns: patterns[hold] = max([p for n, p in positions.items() if fnmatchcase(n, hold)], default=-1)
+                if patterns[hold] >= batch: return True
+            elif positions.get(hold, -1) >= batch: return True
+        return False
+    # A function to find the task arrays containing a section matching a wildcard hold, where the array name does not match the hold.
+    # NB: The arrays matching each wildcard hold are updated as sections are added to arrays, rather than searching them each time:
+    def arraysMatching(hold):
+        if hold not in array_holds: array_holds[hold] = OrderedDict.fromkeys([a for n, a in arrays.items() if fnmatchcase(n, hold) and not fnmatchcase(a, hold)])
+        return list(array_holds[hold])
+    for item in sections:
+        section = item[2]
+        holds = []
+        for hold in section.holds:
+            if any([c in hold for c in '*?[']): holds.extend([hold] + arraysMatching(hold))
+            else: holds.append(arrays.get(hold, hold))
+        if holds != list(section.holds): section.holds = HoldList(list(OrderedDict.fromkeys(holds)))
+        key = formatter.arrayKey(section)
+        batch = open_batches.get(key) if key is not None else None
+        if (batch is not None) and holdsFrom(section.holds, batch):
+            log.debug('section {} holds on a section in or after task array {}; starting a new batch'.format(section.name, batches[batch][0]))
+            batch = None
+        if batch is not None:
+            name, items = batches[batch]
+            items.append(item)
+            arrays[section.name] = name
+            for hold in array_holds:
+                if fnmatchcase(section.name, hold) and not fnmatchcase(name, hold): array_holds[hold][name] = None
+        else:
+            batch = len(batches)
+            batches[batch] = (section.name, [item])
+            if key is not None: open_batches[key] = batch
+        positions[section.name] = max(positions.get(section.name, -1), batch)
+        for hold in patterns:
+            if fnmatchcase(section.name, hold): patterns[hold] = max(patterns[hold], batch)
+        buffered += 1
+        if buffered >= batch_size:
+            yield from batches.values()
+            batches = OrderedDict()
+            open_batches = {}
+            positions = {}
+            patterns = {}
+            buffered = 0
+    yield from batches.values()
+
+# A function to hash each of a stream of (i, N, section) items for the submission journal, before their holds can be rewritten.
+# The hashes are stored in hashes (by section id). If resume is True, sections whose hash is already in the journal are skipped: their names are added to skipped, and their journaled job IDs to resumed (a list for each name, as several sections can share a name).
+# NB: Sections run locally have completed, so holds on skipped sections are removed; scheduler jobs may still be running, so holds on them are kept:
+def iterJournalSections(log, sections, formatter, journal, hashes, resumed, skipped, resume=False, local=False):
+    journaled = {}
+    if resume is True:
+        journaled = journal.job_ids
+        log.info('resuming from journal "{}" ({} sections)'.format(journal.filename, len(journaled)))
+    for item in sections:
+        section = item[2]
+        section_hash = SubmissionJournal.hashData(formatter.newline.join(formatter.format(section)))
+        if section_hash in journaled:
+            log.info('skipping section {} (already in journal)'.format(section.name))
+            resumed.setdefault(section.name, []).append(journaled[section_hash])
+            skipped.append(section.name)
+            continue
+        if (local is True) and any([h in resumed for h in section.holds]):
+            section.holds = HoldList([h for h in section.holds if h not in resumed])
+        hashes[id(section)] = section_hash
+        yield item
+
+# A function to write to stdout through a large binary buffer, rather than line by line:
+# NB: Pending text output is flushed first, and the buffer is flushed (leaving stdout open) when done
+@contextmanager
+def openStdoutBuffer(buffer_size=1048576):
+    stdout.flush()
+    try: stdout_fd = stdout.fileno()
+    except (AttributeError, OSError):
+        yield stdout.buffer
+        stdout.buffer.flush()
+        return
+    with open(stdout_fd, 'wb', buffering=buffer_size, closefd=False) as output_buffer: yield output_buffer
+
+# A function to create the shared URL fetcher (clearing its cache if requested):
+def initURLFetcher(log, args):
+    fetcher = URLFetcher(cache_path=URLFetcher.defaultCachePath())
+    if args.clear_url_cache is True:
+        log.info('removed {} cached URL files from "{}"'.format(fetcher.clearCache(), fetcher.cache_path))
+    if args.url_cache is False: fetcher.cache_path = None
+    setDefaultFetcher(fetcher)
+    return fetcher
+
+# A function to clear (if requested) and return the TFF cache to use:
+def initTFFCache(log, args):
+    tff_cache = qstokens.TFFCache()
+    if args.clear_tff_cache is True:
+        log.info('removed {} cached TFF files from "{}"'.format(tff_cache.clear(), tff_cache.path))
+    if args.tff_cache is True: return tff_cache
+    return None
+
 def qsmain():
     # Define the defaults:
-    defaults = {'verbosity_level':'warning', 'submission_format':'qsub', 'submission_timeout':None, 'url_encoding':'UTF-8'}
+    defaults = {'verbosity_level':'warning', 'submission_format':'qsub', 'submission_timeout':None, 'url_encoding':'UTF-8', 'jobs':1, 'tff_parser':'line', 'tff_cache':False, 'tff_jobs':4, 'url_cache':False, 'submission_batch':1, 'submission_jobs':None, 'submission_rate':None, 'submission_retries':0, 'journal':None}
     # Create the command line interface:
     parser = argparse.ArgumentParser(description='Expand QSUB section templates')
     parser.add_argument('-V', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
@@ -77,11 +292,27 @@ def qsmain():
     parser.add_argument('-i', '--input-json', dest='input_json', action='store_true', default=False, help='input JSON-formatted section data instead of template file')
     parser.add_argument('-j', '--output-json', dest='output_json', action='store_true', default=False, help='return data in JSON format')
     parser.add_argument('-e', '--url-encoding', dest='url_encoding', metavar='enc', default=defaults['url_encoding'], help='encoding to use when reading data from URLs (default {url_encoding})'.format(**defaults))
+    parser.add_argument('--jobs', dest='jobs', metavar='N', type=int, default=defaults['jobs'], help='the number of processes to use when expanding the template (default {jobs})'.format(**defaults))
+    parser.add_argument('--tff-parser', dest='tff_parser', default=defaults['tff_parser'], choices=tff_parsers.keys(), help='the parser to use when reading TFF token files (default {tff_parser})'.format(**defaults))
+    parser.add_argument('--tff-cache', dest='tff_cache', action='store_true', default=defaults['tff_cache'], help='cache parsed TFF files on disk (in {})'.format(qstokens.TFFCache.defaultPath()))
+    parser.add_argument('--no-tff-cache', dest='tff_cache', action='store_false', help='do not cache parsed TFF files on disk')
+    parser.add_argument('--clear-tff-cache', dest='clear_tff_cache', action='store_true', default=False, help='remove all cached TFF data before parsing')
+    parser.add_argument('--tff-jobs', dest='tff_jobs', metavar='N', type=int, default=defaults['tff_jobs'], help='the number of TFF files and URLs to read concurrently (default {tff_jobs})'.format(**defaults))
+    parser.add_argument('--tff-processes', dest='tff_processes', action='store_true', default=False, help='read TFF files in separate processes rather than threads')
+    parser.add_argument('--url-cache', dest='url_cache', action='store_true', default=defaults['url_cache'], help='cache data read from URLs on disk (in {})'.format(URLFetcher.defaultCachePath()))
+    parser.add_argument('--no-url-cache', dest='url_cache', action='store_false', help='do not cache data read from URLs on disk')
+    parser.add_argument('--clear-url-cache', dest='clear_url_cache', action='store_true', default=False, help='remove all cached URL data before reading')
     # Submission options:
     submission_group = parser.add_argument_group('Submission options')
-    submission_group.add_argument('-f', '--sub-format', dest='submission_format', default=defaults['submission_format'], choices=['qsub', 'bash', 'pbash', 'bsub'], help='the submission format to use when using -s (default {submission_format})'.format(**defaults))
+    submission_group.add_argument('-f', '--sub-format', dest='submission_format', default=defaults['submission_format'], choices=['qsub', 'bash', 'pbash', 'bsub', 'slurm', 'pbs'], help='the submission format to use when using -s (default {submission_format})'.format(**defaults))
     submission_group.add_argument('--sub-exec', dest='submission_exec', metavar='exec', default=None, help='override the default executable to use when submitting with -s')
-    submission_group.add_argument('--sub-timeout', dest='submission_timeout', metavar='sec', default=defaults['submission_timeout'], type=int, help='submission timeout in seconds when submitting with -s (default {submission_timeout})'.format(**defaults))
+    submission_group.add_argument('--sub-timeout', dest='submission_timeout', metavar='sec', default=defaults['submission_timeout'], type=int, help='submission timeout in seconds when submitting with -s, except for pbash (default {submission_timeout})'.format(**defaults))
+    submission_group.add_argument('-b', '--sub-batch', dest='submission_batch', metavar='N', type=int, default=defaults['submission_batch'], help='combine up to N compatible scheduler sections into a single task array (default {submission_batch})'.format(**defaults))
+    submission_group.add_argument('--sub-jobs', dest='submission_jobs', metavar='N', type=int, default=defaults['submission_jobs'], help='the number of submissions to run concurrently when submitting with -s (default 1, or the number of CPUs for pbash)')
+    submission_group.add_argument('--sub-rate', dest='submission_rate', metavar='R', type=float, default=defaults['submission_rate'], help='start at most R submissions per second when submitting with -s (default {submission_rate})'.format(**defaults))
+    submission_group.add_argument('--sub-retries', dest='submission_retries', metavar='N', type=int, default=defaults['submission_retries'], help='retry failed scheduler submissions up to N times with exponential backoff (default {submission_retries})'.format(**defaults))
+    submission_group.add_argument('--journal', dest='journal', metavar='file', default=defaults['journal'], help='append a record of each section submitted with -s to file')
+    submission_group.add_argument('--resume', dest='resume', action='store_true', default=False, help='do not submit sections already recorded in the journal')
     submission_group.add_argument('-p', '--purge-logs', dest='purge_logs', action='store_true', default=False, help='purge section log files when submitting with -s')
     submission_group.add_argument('-l', '--cmd-filter', dest='filter_commands', metavar='regex', default=None, help='only include commands whose names match the regular expression regex. If regex is prefixed with ! then the regular expression is inverted')
     submission_group.add_argument('--cmd-start', dest='first_command', metavar='cmd', default=None, help='do not include any commands before the first instance of command cmd')
@@ -107,18 +338,23 @@ def qsmain():
 
     # Check for illegal option combinations:
     if (args.input_json is True) and (args.show_tokens is True): error(log, 'Can not show tokens when reading processed JSON')
+    if (args.journal is not None) and (args.submit is False): error(log, 'Can only use a journal when submitting (use -s)')
+    if (args.resume is True) and (args.submit is False): error(log, 'Can only resume when submitting (use -s)')
+    if (args.resume is True) and (args.journal is None): error(log, 'Can not resume without a journal (use --journal)')
 
     # If requested, load the sections from JSON:
     if args.input_json is True:
         log.info('reading JSON from file "{}"'.format(args.template_file))
         try: sections = SectionList.fromJSONFile(args.template_file)
         except: error(log, 'failed to read JSON section data from "{}"'.format(args.template_file))
+        combinations = len(sections)
+        sections = enumerate(sections)
     else:
         # Read & process the template file
         log.info('reading template file "{}"'.format(args.template_file))
     
         # Load the tokens:
-        tsp = qstokens.TFFParser(encoding=args.url_encoding)
+        tsp_kwargs = {'encoding':args.url_encoding, 'cache':initTFFCache(log, args), 'fetcher':initURLFetcher(log, args)}
         tokens = qstokens.TokenSet()
         try:
             if isURL(args.template_file):
@@ -137,84 +373,36 @@ def qsmain():
             exit(0)
 
         # Load the tokens (from multiple possible sources):
-        for t in args.tokens:
-            try:
-                if t == '-':
-                    # Read from stdin:
-                    log.info('reading tokens from stdin')
-                    ts_new = tsp.parseHandle(stdin)
-                elif isURL(t):
-                    log.info('reading tokens from URL {}'.format(t))
-                    ts_new = tsp.parseURL(t)
-                elif os.path.exists(t):
-                    f_path = os.path.realpath(t)
-                    log.info('reading tokens from file {}'.format(f_path))
-                    ts_new = tsp.parse(f_path)
-                else:
-                    log.info('reading tokens from command line "{}"'.format(t))
-                    ts_new = tsp.parseString(t)
-                tokens.extend(ts_new)
-            except qstokens.MissingTokenError as err: error(log, 'missing tokens "{}" in file "{}"'.format('", "'.join(err.tokens), f_path))
+        for t, ts_future in parseTokenSources(log, args.tokens, tff_parsers[args.tff_parser], tsp_kwargs, jobs=args.tff_jobs, processes=args.tff_processes):
+            try: tokens.extend(ts_future.result())
+            except qstokens.MissingTokenError as err: error(log, 'missing tokens "{}" in file "{}"'.format('", "'.join(err.tokens), t))
             except BaseException as err: error(log, str(err))
         
-        # Execute the template to yield the sections:
+        # Execute the template to yield the sections (as they are generated):
         log.info('executing template')
-        try: template.execute(tokens)
-        except qstokens.MissingTokenError as err:
-            if args.raise_errors is True: raise
-            missing = err.tokens
-            if len(missing) == 1: error(log, 'missing token {}'.format(list(missing)[0]))
-            else: error(log, 'missing tokens {}'.format(', '.join(missing)))
-        except qstokens.CyclicTokenDependencyError as err: error(log, 'cyclic dependencies ({})'.format(', '.join(err.tokens)))    
-        except BaseException as err:
-            if args.raise_errors is True: raise
-            error(log, str(err))
-    
-        # Extract the section data from the template:
-        sections = template.sections
-    
+        combinations = template.getCombinations(tokens)
+        def iterTemplateSections():
+            try: yield from template.iterExecute(tokens, jobs=args.jobs)
+            except qstokens.MissingTokenError as err:
+                if args.raise_errors is True: raise
+                missing = err.tokens
+                if len(missing) == 1: error(log, 'missing token {}'.format(list(missing)[0]))
+                else: error(log, 'missing tokens {}'.format(', '.join(missing)))
+            except qstokens.CyclicTokenDependencyError as err: error(log, 'cyclic dependencies ({})'.format(', '.join(err.tokens)))
+            except BaseException as err:
+                if args.raise_errors is True: raise
+                error(log, str(err))
+        sections = iterTemplateSections()
+
     # Limit commands, if necessary:
     if (args.filter_commands is not None) or (args.first_command is not None) or (args.last_command is not None):
-        for section in sections:
-            # If specified, turn off preceeding commands:
-            if args.first_command is not None:
-                if args.first_command not in section.commands.names: log.warning('invalid first command specified ({}); no commands will be selected'.format(args.first_command))
-                for cmd in section.commands:
-                    if cmd.cmdtype != CommandType.command: continue
-                    if cmd.name == args.first_command: break
-                    cmd.include = False
-            # If specified, turn off subsequent commands:
-            if args.last_command is not None:
-                if args.last_command not in section.commands.names: log.warning('invalid last command specified ({}); no commands will be selected'.format(args.last_command))
-                for i in range(len(section.commands)):
-                    cmd = section.commands[-i] # Iterate backwards
-                    if cmd.cmdtype != CommandType.command: continue
-                    if cmd.name == args.last_command: break
-                    cmd.include = False
-            # If specified, limit to commands matching regular expression:
-            if args.filter_commands is not None:
-                # compile the regular expression:
-                try:
-                    if args.filter_commands.startswith('!'):
-                        args.filter_commands = args.filter_commands.lstrip('!')
-                        log.info('inverting regular expression "{}"'.format(args.filter_commands))
-                        invert = True
-                    else: invert = False
-                    log.info('filtering commands with regular expression "{}"'.format(args.filter_commands))
-                    command_re = re.compile(args.filter_commands)
-                except: error(log, 'failed to parse the regular expression ({})'.format(args.filter_commands))
-                # Match against regular expression:
-                for cmd in section.commands:
-                    if cmd.cmdtype != CommandType.command: continue
-                    match = command_re.match(cmd.name)
-                    if ((match is None) and (invert is False)) or ((match is not None) and (invert is True)):
-                        cmd.include = False
+        sections = iterFilteredSections(log, sections, args.filter_commands, args.first_command, args.last_command)
 
     # If requested, print out the section descriptions:
     if args.show_sections is True:
         log.info('returning section descriptions')
         section_data = []
-        for section in sections:
+        for combination, section in sections:
             s = OrderedDict()
             s['name'] = section.name
             s['description'] = section.description
@@ -229,7 +417,7 @@ def qsmain():
     # If requested, print out the commands:
     if args.show_commands is True:
         log.info('returning commands')
-        for section in sections:
+        for combination, section in sections:
             for command in section.commands:
                 if command.cmdtype != CommandType.command: continue
                 if command.include != True: continue
@@ -239,7 +427,9 @@ def qsmain():
     # If requested, print out the commands in JSON format:
     if args.output_json is True:
         log.info('returning JSON data')
-        print(sections.asJSON(indent='\t'))
+        with openStdoutBuffer() as output_buffer:
+            for section_json in iterSectionJSON((section for combination, section in sections), indent='\t'): output_buffer.write(section_json.encode('UTF-8'))
+            output_buffer.write(b'\n')
         exit(0)
     
     # Process the commands through the specified output formatter:
@@ -247,58 +437,170 @@ def qsmain():
     elif args.submission_format == 'bsub': formatter = qsubsec.sectionFormatter.LSFFormatter
     elif args.submission_format == 'bash': formatter = qsubsec.sectionFormatter.BashFormatter
     elif args.submission_format == 'pbash': formatter = qsubsec.sectionFormatter.BashFormatter    
+    elif args.submission_format == 'slurm': formatter = qsubsec.sectionFormatter.SlurmFormatter
+    elif args.submission_format == 'pbs': formatter = qsubsec.sectionFormatter.PBSFormatter
     else: error(log, 'no formatter for submission format {}'.format(args.submission_format))
     log.info('submission format is {}'.format(args.submission_format))
+    # Group compatible sections into task arrays, if requested:
+    sections = iterSectionProgress(sections, combinations)
+    journal = None
+    journal_hashes = {}
+    resumed = OrderedDict()
+    resumed_sections = []
+    if args.journal is not None:
+        journal = SubmissionJournal(args.journal)
+        sections = iterJournalSections(log, sections, formatter, journal, journal_hashes, resumed, resumed_sections, resume=args.resume, local=args.submission_format in ('bash', 'pbash'))
+    if args.submission_batch > 1:
+        log.info('combining up to {} compatible sections into task arrays'.format(args.submission_batch))
+        batches = iterSectionBatches(log, sections, formatter, args.submission_batch)
+    else: batches = ((item[2].name, [item]) for item in sections)
+    def formatBatch(name, items):
+        if len(items) == 1: return formatter.newline.join(formatter.format(items[0][2]))
+        return formatter.newline.join(formatter.formatArray([section for i, total, section in items], name))
     if args.submit is False:    
-        # Print the formatted data, rather than submitting it:
+        # Write the formatted data, rather than submitting it:
         log.info('writing formatted data to stdout')
-        if len(sections) > 1: log.warning('concatenating multiple sections')
-        for section in sections: print(formatter.newline.join(formatter.format(section)))
+        with openStdoutBuffer() as output_buffer:
+            for i, (name, items) in enumerate(batches):
+                if i == 1: log.warning('concatenating multiple sections')
+                try:
+                    if len(items) == 1: formatter.writeSection(items[0][2], output_buffer)
+                    else: formatter.writeArray([section for i, total, section in items], name, output_buffer)
+                except ValueError as err: error(log, 'failed to format section {} ({})'.format(name, err))
     else:
         # Submit the formatted data:
-        info_str = '[{{:{0}}}/{{:{0}}}]: submitting section {{}}'.format(floor(log10(len(sections))))
         submission_exec = args.submission_exec
         if submission_exec is None:
             if args.submission_format == 'qsub': submission_exec = 'qsub'
             elif args.submission_format == 'bash': submission_exec = 'bash'
             elif args.submission_format == 'pbash': submission_exec = 'bash'
+            elif args.submission_format == 'bsub': submission_exec = 'bsub'
+            elif args.submission_format == 'slurm': submission_exec = 'sbatch'
+            elif args.submission_format == 'pbs': submission_exec = 'qsub'
             else: error(log, 'no submission executable set for format {}'.format(args.submission_format))
         # Determine how to submit:
-        if args.submission_format == 'qsub': submission_method = outputSubmitterProc
-        elif args.submission_format == 'bash': submission_method = outputSubmitterProc
-        elif args.submission_format == 'pbash': submission_method = outputSubmitterShell
-        else: submission_method = outputSubmitterProc
-        log.info('submitting {} formatted sections using executable "{}"'.format(len(sections), submission_exec))
+        if args.submission_format == 'qsub': submission_method = outputSubmitterAsync
+        elif args.submission_format == 'bash': submission_method = outputSubmitterAsync
+        elif args.submission_format == 'pbash': submission_method = outputSubmitterAsyncShell
+        elif args.submission_format == 'slurm': submission_method = outputSubmitterSlurm
+        elif args.submission_format == 'pbs': submission_method = outputSubmitterPBS
+        else: submission_method = outputSubmitterAsync
+        # Sections are run one at a time unless requested; pbash runs as many local sections at once as there are CPUs:
+        submission_jobs = args.submission_jobs
+        if submission_jobs is None:
+            if args.submission_format == 'pbash': submission_jobs = os.cpu_count() or 1
+            else: submission_jobs = 1
+        log.info('submitting formatted sections using executable "{}"'.format(submission_exec))
         submission_exec = submission_exec.split()
-        for i in range(len(sections)):
-            section_data = formatter.newline.join(formatter.format(sections[i]))
-            section_name = sections[i].name
-            if args.purge_logs is True:
-                sec_files = OrderedDict()
-                sec_files['output'] = sections[i].outfile.getFilename(section_name)
-                sec_files['error'] = sections[i].errfile.getFilename(section_name)
-                for file_type in sec_files.keys():
-                    try:
-                        log.info('purging section {} file "{}"'.format(file_type, sec_files[file_type]))
-                        os.remove(sec_files[file_type])
-                    except FileNotFoundError: pass
-                    except: log.warning('failed to purge section {} file "{}"'.format(file_type, sec_files[file_type]))
-            #Attempt to spawn the subprocess:
-            try:
-                print(info_str.format(i + 1, len(sections), section_name), file=stdout)
+        # NB: Only scheduler submissions are retried, as retrying a bash section would run its commands again:
+        retry = args.submission_format in ('qsub', 'bsub', 'slurm', 'pbs')
+        if (retry is False) and (args.submission_retries > 0): log.warning('submission retries are ignored for submission format {}'.format(args.submission_format))
+        # NB: Sections run in parallel with pbash are long-running local jobs rather than submissions, so they are never timed out:
+        submission_timeout = args.submission_timeout
+        if args.submission_format == 'pbash':
+            if submission_timeout is not None: log.warning('the submission timeout is ignored for submission format pbash')
+            submission_timeout = None
+        # Formats holding on job IDs are only formatted once the sections they hold on have been submitted, with their holds replaced by the job IDs.
+        # Holds on sections skipped from the journal use their journaled job IDs, and any other holds starting with a digit are taken to be existing job IDs.
+        # NB: The journaled job IDs are found when the section is handed to the submission pool, as resumed is still being filled by the main thread when the holds are resolved:
+        def resumedJobIDs(holds):
+            resumed_ids = {}
+            if len(resumed) == 0: return resumed_ids
+            for hold in holds:
+                if hold in resumed: resumed_ids[hold] = list(resumed[hold])
+                elif re.match('[0-9]', hold) is not None: continue
+                elif any([c in hold for c in '*?[']): resumed_ids[hold] = [job_id for n in resumed if fnmatchcase(n, hold) for job_id in resumed[n]]
+            return resumed_ids
+        def resolveHolds(data, outputs, unmatched):
+            name, items, resumed_ids = data
+            job_ids = []
+            for output in outputs:
+                job_id = submission_method.parseJobID(output)
+                if job_id is None: log.warning('section {} holds on a section with no job ID; ignoring hold'.format(name))
+                else: job_ids.append(job_id)
+            # Wildcard holds can match both submitted and skipped sections:
+            for hold, matches in resumed_ids.items():
+                if hold not in unmatched: job_ids.extend([m for m in matches if m is not None])
+            for hold in unmatched:
+                if hold in resumed_ids: matches = resumed_ids[hold]
+                elif re.match('[0-9]', hold) is not None: matches = [hold]
+                else: matches = []
+                if len(matches) == 0: log.warning('section {} holds on unknown section {}; ignoring hold'.format(name, hold))
+                elif None in matches: log.warning('section {} holds on section {} with no journaled job ID; ignoring hold'.format(name, hold))
+                job_ids.extend([m for m in matches if m is not None])
+            for i, total, section in items: section.holds = HoldList(list(OrderedDict.fromkeys(job_ids)))
+            return formatBatch(name, items)
+        submission_pool = SubmissionPool(submission_method, submission_exec, jobs=submission_jobs, timeout=submission_timeout, check=True, rate=args.submission_rate, retries=args.submission_retries if retry is True else 0, resolve=resolveHolds if formatter.hold_job_ids is True else None)
+        batch_items = deque()
+        def iterSubmissionData():
+            submitted = 0
+            for name, items in batches:
+                holds = list(OrderedDict.fromkeys([h for i, total, section in items for h in section.holds]))
+                if formatter.hold_job_ids is True: section_data = (name, items, resumedJobIDs(holds))
+                else:
+                    try: section_data = formatBatch(name, items)
+                    except ValueError as err: error(log, 'failed to format section {} ({})'.format(name, err))
+                if args.purge_logs is True:
+                    for i, total, section in items:
+                        sec_files = OrderedDict()
+                        sec_files['output'] = section.outfile.getFilename(section.name)
+                        sec_files['error'] = section.errfile.getFilename(section.name)
+                        for file_type in sec_files.keys():
+                            try:
+                                log.info('purging section {} file "{}"'.format(file_type, sec_files[file_type]))
+                                os.remove(sec_files[file_type])
+                            except FileNotFoundError: pass
+                            except: log.warning('failed to purge section {} file "{}"'.format(file_type, sec_files[file_type]))
+                submitted += len(items)
+                # NB: Sections skipped from the journal are counted as done, so the progress display never goes backwards:
+                done = submitted + len(resumed_sections)
+                total = max(items[-1][1], done)
+                batch_items.append(items)
+                if len(items) == 1: print('[{{:{0}}}/{{:{0}}}]: submitting section {{}}'.format(floor(log10(total))).format(done, total, name), file=stdout)
+                else: print('[{{:{0}}}/{{:{0}}}]: submitting task array {{}} ({{}} sections)'.format(floor(log10(total))).format(done, total, name, len(items)), file=stdout)
                 stdout.flush()
-                submission_method.spawn(proc_exec=submission_exec, data=section_data, timeout=args.submission_timeout)
-            except Exception as err: error(log, 'failed to submit job "{}"'.format(' '.join(submission_exec)))
+                yield name, section_data, holds, list(OrderedDict.fromkeys([section.name for i, total, section in items]))
+        # Submit the sections (concurrently, if requested), reporting any failures in section order.
+        # Sections run locally start once the sections they hold on have completed, and sections holding on job IDs once those have been submitted:
+        if (args.submission_format in ('bash', 'pbash')) or (formatter.hold_job_ids is True): results = submission_pool.iterSpawnGraph(iterSubmissionData())
+        else: results = submission_pool.iterSpawn(((name, data) for name, data, holds, members in iterSubmissionData()))
+        failed = []
+        skipped = []
+        for name, output, err in results:
+            items = batch_items.popleft()
+            section_hashes = [journal_hashes.pop(id(section), None) for i, total, section in items]
+            if err is None:
+                job_id = submission_method.parseJobID(output)
+                if job_id is not None: log.info('submitted section {} as job {}'.format(name, job_id))
+                if journal is not None:
+                    for (i, total, section), section_hash in zip(items, section_hashes): journal.record(section.name, section_hash, job_id)
+            elif isinstance(err, SkippedSectionError): skipped.append(name)
+            else:
+                log.error('failed to submit section {} using "{}" ({})'.format(name, ' '.join(submission_exec), err))
+                failed.append(name)
+        if journal is not None: journal.close()
+        if len(resumed_sections) > 0: log.info('skipped {} section(s) already in journal "{}"'.format(len(resumed_sections), journal.filename))
+        if len(skipped) > 0: log.error('skipped {} section(s) holding on failed sections: {}'.format(len(skipped), ', '.join(skipped)))
+        if len(failed) > 0: error(log, 'failed to submit {} section(s): {}'.format(len(failed), ', '.join(failed)))
 
 def parseTFF():
     # Define the defaults:
-    defaults = {'verbosity_level':'warning', 'output_format':'TFF', 'url_encoding':'UTF-8'}
+    defaults = {'verbosity_level':'warning', 'output_format':'TFF', 'url_encoding':'UTF-8', 'tff_parser':'line', 'tff_cache':False, 'tff_jobs':4, 'url_cache':False}
     # Create the command line interface:
     parser = argparse.ArgumentParser(description='Parse qsubsec token TFF files')
     parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
     parser.add_argument('-V', '--verbose', dest='verbosity_level', default=defaults['verbosity_level'], choices=['error', 'warning', 'info', 'debug'], help='Set logging level (default {verbosity_level})'.format(**defaults))
     parser.add_argument('-o', '--output-format', dest='output_format', choices={'JSON', 'TFF', 'dict'}, default=defaults['output_format'], help='output format for single resolved token sets (default {output_format})'.format(**defaults))
     parser.add_argument('-e', '--url-encoding', dest='url_encoding', metavar='enc', default=defaults['url_encoding'], help='encoding to use when reading data from URLs (default {url_encoding})'.format(**defaults))
+    parser.add_argument('--tff-parser', dest='tff_parser', default=defaults['tff_parser'], choices=tff_parsers.keys(), help='the parser to use when reading TFF files (default {tff_parser})'.format(**defaults))
+    parser.add_argument('--tff-cache', dest='tff_cache', action='store_true', default=defaults['tff_cache'], help='cache parsed TFF files on disk (in {})'.format(qstokens.TFFCache.defaultPath()))
+    parser.add_argument('--no-tff-cache', dest='tff_cache', action='store_false', help='do not cache parsed TFF files on disk')
+    parser.add_argument('--clear-tff-cache', dest='clear_tff_cache', action='store_true', default=False, help='remove all cached TFF data before parsing')
+    parser.add_argument('--tff-jobs', dest='tff_jobs', metavar='N', type=int, default=defaults['tff_jobs'], help='the number of TFF files and URLs to read concurrently (default {tff_jobs})'.format(**defaults))
+    parser.add_argument('--tff-processes', dest='tff_processes', action='store_true', default=False, help='read TFF files in separate processes rather than threads')
+    parser.add_argument('--url-cache', dest='url_cache', action='store_true', default=defaults['url_cache'], help='cache data read from URLs on disk (in {})'.format(URLFetcher.defaultCachePath()))
+    parser.add_argument('--no-url-cache', dest='url_cache', action='store_false', help='do not cache data read from URLs on disk')
+    parser.add_argument('--clear-url-cache', dest='clear_url_cache', action='store_true', default=False, help='remove all cached URL data before reading')
     output_types = parser.add_mutually_exclusive_group(required=False)
     output_types.add_argument('-q', '--quiet', dest='quiet', action='store_true', default=False, help='do not print output')
     output_types.add_argument('-a', '--print-all', dest='print_all', action='store_true', default=False, help='output multiple resolved token sets in long format')
@@ -321,29 +623,14 @@ def parseTFF():
     log = setupLog(args.verbosity_level)
 
     # Initialise the TFF parser:
-    tsp = qstokens.TFFParser(encoding=args.url_encoding)
+    tsp_kwargs = {'encoding':args.url_encoding, 'cache':initTFFCache(log, args), 'fetcher':initURLFetcher(log, args)}
+    tsp = tff_parsers[args.tff_parser](**tsp_kwargs)
     ts = qstokens.TokenSet()
 
-    # Parse input source in turn:
-    for t in args.input_files:
-        try:
-            if t == '-':
-                # Read from stdin:
-                log.info('reading tokens from stdin')
-                ts_new = tsp.parseHandle(stdin)
-            elif isURL(t):
-                log.info('reading tokens from URL {}'.format(t))
-                ts_new = tsp.parseURL(t)
-                log.info('done reading URL') # REWMOVE THIS!
-            elif os.path.exists(t):
-                f_path = os.path.realpath(t)
-                log.info('reading tokens from file {}'.format(f_path))
-                ts_new = tsp.parse(f_path)
-            else:
-                log.info('reading tokens from command line "{}"'.format(t))
-                ts_new = tsp.parseString(t)
-            ts.extend(ts_new)
-        except qstokens.MissingTokenError as err: error(log, 'missing tokens "{}" in file "{}"'.format('", "'.join(err.tokens), f_path))
+    # Parse input sources (concurrently), merging them in order:
+    for t, ts_future in parseTokenSources(log, args.input_files, tff_parsers[args.tff_parser], tsp_kwargs, jobs=args.tff_jobs, processes=args.tff_processes):
+        try: ts.extend(ts_future.result())
+        except qstokens.MissingTokenError as err: error(log, 'missing tokens "{}" in file "{}"'.format('", "'.join(err.tokens), t))
         except BaseException as err: error(log, str(err))
 
     # Parse a specific string, if requested:
@@ -370,11 +657,25 @@ def parseTFF():
 
     # Resolve the complete token set:
     log.info('resolving tokens')
-    try: res = ts.resolve()
+    # NB: resolved token sets are streamed, so only the first is held back until we know if there are more:
+    res_n = 0
+    first = None
+    try:
+        for res in ts.iterResolve():
+            res_n += 1
+            if args.quiet is True: continue
+            if res_n == 1:
+                first = res
+                continue
+            if res_n == 2:
+                if args.print_all is True: print(longFormat(first))
+                else: print('[{}]: {}'.format(0, first.asDict()))
+                first = None
+            if args.print_all is True: print(longFormat(res))
+            else: print('[{}]: {}'.format(res_n - 1, res.asDict()))
     except qstokens.CyclicTokenDependencyError as err: error(log, 'cyclic dependencies: "{}"'.format('", "'.join(err.tokens)))
     except qstokens.MissingTokenError as err: error(log, 'missing tokens "{}"'.format('", "'.join(err.tokens)))
     except BaseException as err: error(log, str(err))
-    res_n = len(res)
 
     # If quiet was requested, simply exit at this stage, as there were no errors:
     if args.quiet is True: exit(0)
@@ -382,12 +683,8 @@ def parseTFF():
     # If a single token set is generated, print it in long-hand format:
     if res_n == 1:
         log.info('1 resolved token set generated')
-        print(longFormat(res[0]))
-    else:
-        log.info(format('{} resolved token sets generated:'.format(res_n)))
-        for i in range(res_n):
-            if args.print_all is True: print(longFormat(res[i]))
-            else: print('[{}]: {}'.format(i, res[i].asDict()))
+        print(longFormat(first))
+    else: log.info(format('{} resolved token sets generated'.format(res_n)))
 
 def updateTemplate():
     # Create the command line interface:
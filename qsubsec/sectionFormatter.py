@@ -16,10 +16,83 @@ from os import remove
 from collections import OrderedDict
 import logging as log
 import json
+import re
+
+# The shell check for each requirement type, formatted with the requirement name, the echo prefix and the message suffix:
+requirement_checks = {
+    Requirement.PATH_ABSENT: 'if ! test -e {0}; then {1}ERROR: file {0} exists{2}; exit 1; fi',
+    Requirement.PATH_PRESENT: 'if test -e {0}; then {1}ERROR: file {0} not found{2}; exit 1; fi',
+    Requirement.PATH_READABLE: 'if ! test -r {0}; then {1}ERROR: file {0} not readable{2}; exit 1; fi',
+    Requirement.PATH_WRITABLE: 'if ! test -w {0}; then {1}ERROR: file {0} not writable{2}; exit 1; fi',
+    Requirement.PATH_EXECUTABLE: 'if [ ! -x "$(command -v {0})" ]; then {1}ERROR: file {0} not executable{2}; exit 1; fi',
+    Requirement.ENV_SET: 'if [ -z ${{{0}+x}} ]; then {1}ERROR: environment variable {0} not set{2}; exit 1; fi',
+    Requirement.ENV_UNSET: 'if [ -n ${{{0}+x}} ]; then {1}ERROR: environment variable {0} set{2}; exit 1; fi',
+}
+
+# The words in a task script that can be looked up in a task array table (other text must be the same for every task):
+table_word_re = re.compile(r'([A-Za-z0-9_]+)')
+
+def iterQuoteStates(parts):
+    """Generate the shell quoting state (None, a single quote or a double quote) at the start of each part of a script"""
+    quote = None
+    escaped = False
+    for part in parts:
+        yield quote
+        for c in part:
+            if escaped is True: escaped = False
+            elif quote == "'":
+                if c == "'": quote = None
+            elif c == '\\': escaped = True
+            elif quote == '"':
+                if c == '"': quote = None
+            elif c in '\'"': quote = c
+
+class SectionConstants(object):
+    """The strings used throughout the output for a single section: the log filenames, the echo prefix and the suffixes
+    closing echo commands (optionally appending the message to a log file)"""
+    __slots__ = ('outfile', 'errfile', 'echo', 'out_suffix', 'err_suffix', 'status_suffix', 'failure_suffix')
+    def __init__(self, formatter, section):
+        self.outfile = section.outfile.getFilename(section.name)
+        self.errfile = section.errfile.getFilename(section.name)
+        self.echo = 'echo "[{}]: '.format(formatter.timestampString())
+        self.out_suffix = '" >> {}'.format(self.outfile)
+        self.err_suffix = '" >> {}'.format(self.errfile)
+        if formatter.status_logged is True:
+            self.status_suffix = self.out_suffix
+            self.failure_suffix = self.err_suffix
+        else:
+            self.status_suffix = '"'
+            self.failure_suffix = '"'
 
 class OutputFormatter(object):
+    """Formats sections as shell scripts. Each output format is described by the class attributes below, and shares
+    the same rendering methods"""
     option_prefix = '#'
     newline = '\n'
+    encoding = 'UTF-8'
+    # Lines written before anything else (such as an interpreter line):
+    preamble = ()
+    # Scheduler directives (no directives are written if name_option is None):
+    name_option = None
+    # Limits use the directive given for the limit in limit_directives (or limit_directive), formatted with the limit name and value:
+    limit_directive = None
+    limit_directives = {}
+    # Each hold is formatted as hold_term, and written as hold_directive (one directive per hold, or a single directive joining them with hold_separator):
+    hold_directive = None
+    hold_term = '{}'
+    hold_separator = None
+    # Do holds refer to scheduler job IDs (resolved when submitting) rather than job names?
+    hold_job_ids = False
+    # Task array support (not supported if array_variable is None):
+    array_option = None
+    array_variable = None
+    array_task_id = None
+    # Are section & command status messages appended to the section log files (rather than left to the scheduler)?
+    status_logged = False
+    # The requirements whose failure messages are appended to the section error log:
+    logged_requirements = frozenset()
+    # Are signal handlers trapped for sections with checks enabled?
+    signal_traps = False
     @classmethod
     def timestampString(cls): return '`date`'
     @classmethod
@@ -28,153 +101,276 @@ class OutputFormatter(object):
         else: prefix = ''
         return 'echo "{}{}"'.format(prefix, message)
     @classmethod
-    def frontMatter(cls, section):
-        return []
+    def sectionConstants(cls, section): return SectionConstants(cls, section)
     @classmethod
-    def commands(cls, section):
-        return []
+    def requirementChecks(cls):
+        """Return the check for each requirement type, and whether its failure message is logged (built once for each format)"""
+        checks = cls.__dict__.get('_requirement_checks')
+        if checks is None:
+            checks = {r:(check, r in cls.logged_requirements) for r, check in requirement_checks.items()}
+            cls._requirement_checks = checks
+        return checks
     @classmethod
-    def endMatter(cls, section):
-        return []
+    def limitDirective(cls, limit, value): return cls.limit_directives.get(limit, cls.limit_directive).format(limit, value)
     @classmethod
-    def format(cls, section):
-        output = []
-        output.extend(cls.frontMatter(section))
-        output.extend(cls.commands(section))
-        output.extend(cls.endMatter(section))
-        return output
-
-class BashFormatter(OutputFormatter):
+    def runLimitSeconds(cls, value):
+        """Return the number of seconds in an SGE h_rt run limit, given as [[hours:]minutes:]seconds"""
+        fields = str(value).strip().split(':')
+        if (len(fields) > 3) or not all([f.isdigit() for f in fields]): raise ValueError('invalid h_rt limit "{}" (expected [[hours:]minutes:]seconds)'.format(value))
+        seconds = 0
+        for field in fields: seconds = (seconds * 60) + int(field)
+        return seconds
     @classmethod
-    def frontMatter(cls, section):
-        output = []
-        for requirement, name in section.requirements:
-            if requirement == Requirement.PATH_ABSENT: output.append('if ! test -e {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} exists'.format(name))))
-            if requirement == Requirement.PATH_PRESENT: output.append('if test -e {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not found'.format(name))))
-            if requirement == Requirement.PATH_READABLE: output.append('if ! test -r {0}; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not readable'.format(name)), section.errfile.getFilename(section.name)))
-            if requirement == Requirement.PATH_WRITABLE: output.append('if ! test -w {0}; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not writable'.format(name)), section.errfile.getFilename(section.name)))
-            if requirement == Requirement.PATH_EXECUTABLE: output.append('if [ ! -x "$(command -v {0})" ]; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not executable'.format(name)), section.errfile.getFilename(section.name)))
-            if requirement == Requirement.ENV_SET: output.append('if [ -z ${{{0}+x}} ]; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: environment variable {} not set'.format(name)), section.errfile.getFilename(section.name)))
-            if requirement == Requirement.ENV_UNSET: output.append('if [ -n ${{{0}+x}} ]; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: environment variable {} set'.format(name)), section.errfile.getFilename(section.name)))
-        if section.log is True: output.append('{0} >> {1}'.format(cls.echoString('section {} started'.format(section.name)), section.outfile.getFilename(section.name)))
-        return output
+    def holdDirectives(cls, holds):
+        terms = [cls.hold_term.format(hold) for hold in holds]
+        if len(terms) == 0: return []
+        if cls.hold_separator is None: return [cls.hold_directive.format(term) for term in terms]
+        return [cls.hold_directive.format(cls.hold_separator.join(terms))]
     @classmethod
-    def commands(cls, section):
-        output = []
-        for command in section.commands:
-            if command.include != True: continue
-            if command.cmdtype is CommandType.log_out:
-                output.append('{0} >> {1}'.format(cls.echoString('{}'.format(command.command)), section.outfile.getFilename(section.name)))
-            elif command.cmdtype is CommandType.log_err:
-                output.append('{0} >> {1}'.format(cls.echoString('{}'.format(command.command)), section.errfile.getFilename(section.name)))
-            else:            
-                if command.log is True: output.append('{0} >> {1}'.format(cls.echoString('command {} started'.format(command.name)), section.outfile.getFilename(section.name)))
-                if command.test is True: output.append('{0} || {{ {1} >> {2}; exit 1; }}'.format(command.command, cls.echoString('command {} failed'.format(command.name)), section.errfile.getFilename(section.name)))
-                else: output.append(command.command)
-                if command.log is True: output.append('{0} >> {1}'.format(cls.echoString('command {} completed'.format(command.name)), section.outfile.getFilename(section.name)))
+    def directives(cls, section, constants=None):
+        if cls.name_option is None: return []
+        if constants is None: constants = cls.sectionConstants(section)
+        prefix = '{} '.format(cls.option_prefix)
+        output = ['{}{} {}'.format(prefix, cls.name_option, section.name)]
+        for limit, value in section.limits.limits.items(): output.append(prefix + cls.limitDirective(limit, value))
+        for option in section.options: output.append(prefix + str(option))
+        for hold in cls.holdDirectives(section.holds): output.append(prefix + hold)
+        output.append('{}-o {}'.format(prefix, constants.outfile))
+        output.append('{}-e {}'.format(prefix, constants.errfile))
         return output
     @classmethod
-    def endMatter(cls, section):
-        output = []
-        if section.log is True: output.append('{0} >> {1}'.format(cls.echoString('section {} completed'.format(section.name)), section.outfile.getFilename(section.name)))
+    def frontMatter(cls, section, constants=None):
+        if constants is None: constants = cls.sectionConstants(section)
+        output = list(cls.preamble)
+        output.extend(cls.directives(section, constants))
+        output.extend(cls.prologue(section, constants))
         return output
-
-class QSUBFormatter(OutputFormatter):
-    option_prefix = '#$'
     @classmethod
-    def frontMatter(cls, section):
+    def prologue(cls, section, constants=None):
+        if constants is None: constants = cls.sectionConstants(section)
         output = []
-        output.append('{} -N {}'.format(cls.option_prefix, section.name))
-        for limit, value in section.limits.limits.items():
-            output.append('{} -l {}={}'.format(cls.option_prefix, limit, value))
-        for option in section.options:
-            output.append('{} {}'.format(cls.option_prefix, str(option)))
-        for hold in section.holds:
-            output.append('{} -hold_jid {}'.format(cls.option_prefix, hold))
-        output.append('{} -o {}'.format(cls.option_prefix, section.outfile.getFilename(section.name)))
-        output.append('{} -e {}'.format(cls.option_prefix, section.errfile.getFilename(section.name)))
+        echo = constants.echo
+        checks = cls.requirementChecks()
         for requirement, name in section.requirements:
-            if requirement == Requirement.PATH_ABSENT: output.append('if ! test -e {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} exists'.format(name))))
-            if requirement == Requirement.PATH_PRESENT: output.append('if test -e {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not found'.format(name))))
-            if requirement == Requirement.PATH_READABLE: output.append('if ! test -r {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not readable'.format(name))))
-            if requirement == Requirement.PATH_WRITABLE: output.append('if ! test -w {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not writable'.format(name))))
-            if requirement == Requirement.PATH_EXECUTABLE: output.append('if [ ! -x "$(command -v {0})" ]; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not executable'.format(name)), section.errfile.getFilename(section.name)))
-            if requirement == Requirement.ENV_SET: output.append('if [ -z ${{{0}+x}} ]; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: environment variable {} not set'.format(name))))
-            if requirement == Requirement.ENV_UNSET: output.append('if [ -n ${{{0}+x}} ]; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: environment variable {} set'.format(name))))
-        if section.check is True:
-            output.append('on_stop() {{ {}; }}'.format(cls.echoString('imminent SIGSTOP (received SIGUSR1)')))
-            output.append('on_kill() {{ {}; }}'.format(cls.echoString('imminent SIGKILL (received SIGUSR2)')))
+            check, logged = checks[requirement]
+            output.append(check.format(name, echo, constants.err_suffix if logged is True else '"'))
+        if (cls.signal_traps is True) and (section.check is True):
+            output.append('on_stop() {{ {}imminent SIGSTOP (received SIGUSR1)"; }}'.format(echo))
+            output.append('on_kill() {{ {}imminent SIGKILL (received SIGUSR2)"; }}'.format(echo))
             output.append('trap \'on_stop\' SIGUSR1')
             output.append('trap \'on_kill\' SIGUSR2')
-        if section.log is True: output.append(cls.echoString('section {} started'.format(section.name)))
+        if section.log is True: output.append('{}section {} started{}'.format(echo, section.name, constants.status_suffix))
         return output
     @classmethod
-    def commands(cls, section):
+    def commands(cls, section, constants=None):
+        if constants is None: constants = cls.sectionConstants(section)
+        echo = constants.echo
+        status_suffix = constants.status_suffix
         output = []
+        append = output.append
         for command in section.commands:
             if command.include != True: continue
-            if command.cmdtype is CommandType.log_out:
-                output.append('{0} >> {1}'.format(cls.echoString('{}'.format(command.command)), section.outfile.getFilename(section.name)))
-            elif command.cmdtype is CommandType.log_err:
-                output.append('{0} >> {1}'.format(cls.echoString('{}'.format(command.command)), section.errfile.getFilename(section.name)))
+            cmdtype = command.cmdtype
+            if cmdtype is CommandType.log_out: append('{}{}{}'.format(echo, command.command, constants.out_suffix))
+            elif cmdtype is CommandType.log_err: append('{}{}{}'.format(echo, command.command, constants.err_suffix))
             else:
-                if command.log is True: output.append(cls.echoString('command {} started'.format(command.name)))
-                if command.test is True: output.append('{0} || {{ {1}; exit 1; }}'.format(command.command, cls.echoString('command {} failed'.format(command.name))))
-                else: output.append(command.command)
-                if command.log is True: output.append(cls.echoString('command {} completed'.format(command.name)))
+                if command.log is True: append('{}command {} started{}'.format(echo, command.name, status_suffix))
+                if command.test is True: append('{} || {{ {}command {} failed{}; exit 1; }}'.format(command.command, echo, command.name, constants.failure_suffix))
+                else: append(command.command)
+                if command.log is True: append('{}command {} completed{}'.format(echo, command.name, status_suffix))
+        return output
+    @classmethod
+    def endMatter(cls, section, constants=None):
+        if section.log is not True: return []
+        if constants is None: constants = cls.sectionConstants(section)
+        return ['{}section {} completed{}'.format(constants.echo, section.name, constants.status_suffix)]
+    @classmethod
+    def format(cls, section):
+        constants = cls.sectionConstants(section)
+        output = cls.frontMatter(section, constants)
+        output.extend(cls.commands(section, constants))
+        output.extend(cls.endMatter(section, constants))
         return output
     @classmethod
-    def endMatter(cls, section):
+    def writeLines(cls, lines, output):
+        """Write formatted lines (each followed by a newline) to a binary stream as a single encoded block"""
+        lines.append('')
+        output.write(cls.newline.join(lines).encode(cls.encoding))
+    @classmethod
+    def writeSection(cls, section, output): cls.writeLines(cls.format(section), output)
+    @classmethod
+    def isDirective(cls, line): return line.startswith('{} '.format(cls.option_prefix))
+    @classmethod
+    def arrayDirectives(cls, name, size): return []
+    @classmethod
+    def arrayKey(cls, section):
+        """Return a key for the scheduler directives shared by the sections in a task array (or None if the section can not be part of a task array).
+        Sections with the same key differ only in their name, log files and script"""
+        if cls.array_variable is None: return None
         output = []
-        if section.log is True: output.append(cls.echoString('section {} completed'.format(section.name)))
+        for line in cls.directives(section)[1:]:
+            option = line[len(cls.option_prefix):].split()[0].split('=')[0]
+            # Sections that set their own array (or job name) options can not be combined:
+            if option in (cls.name_option, cls.array_option): return None
+            if option not in ('-o', '-e'): output.append(line)
+        return tuple(output)
+    @classmethod
+    def arrayFilename(cls, log_file, name):
+        """Return the scheduler log filename for a task array (including the task ID, if the scheduler can substitute it)"""
+        if cls.array_task_id is None: return log_file.getFilename(name)
+        return log_file.getFilename(name, taskarray=True).replace('$TASK_ID', cls.array_task_id)
+    @classmethod
+    def taskLines(cls, section):
+        """Return the lines run by a task array task for a section, appending its output to the section log files"""
+        constants = cls.sectionConstants(section)
+        output = ['exec >> {} 2>> {}'.format(constants.outfile, constants.errfile)]
+        output.extend(cls.prologue(section, constants))
+        output.extend(cls.commands(section, constants))
+        output.extend(cls.endMatter(section, constants))
+        return output
+    @classmethod
+    def arrayTable(cls, sections):
+        """Return a single task script for a set of sections whose scripts differ only in the values of some words (such as token values), and a table of
+        the values taken by each varying word in each task. The script looks the values up using the task ID. Returns None if the scripts differ in any other way.
+        NB: Words are only replaced where a variable expansion gives the same result (outside single quotes and here-documents)"""
+        tasks = [cls.taskLines(section) for section in sections]
+        if any([len(lines) != len(tasks[0]) for lines in tasks]): return None
+        # Split the script into text and varying words (each a tuple of the word in every task). Only the lines that vary are split into words:
+        parts = []
+        for lines in zip(*tasks):
+            if len(parts) > 0: parts.append(cls.newline)
+            if lines.count(lines[0]) == len(lines):
+                parts.append(lines[0])
+                continue
+            words = [table_word_re.split(line) for line in lines]
+            if any([len(w) != len(words[0]) for w in words]): return None
+            for k, values in enumerate(zip(*words)):
+                if values.count(values[0]) == len(values): parts.append(values[0])
+                # Only words can vary between the tasks:
+                elif k % 2 == 0: return None
+                else: parts.append(values)
+        text = [part if isinstance(part, str) else part[0] for part in parts]
+        if '<<' in ''.join(text): return None
+        columns = OrderedDict()
+        script = []
+        for k, (part, quote) in enumerate(zip(parts, iterQuoteStates(text))):
+            if isinstance(part, str):
+                script.append(part)
+                continue
+            # Words that are part of a variable or function name, or follow a backslash or tilde, are interpreted differently when looked up:
+            if (quote == "'") or text[k - 1].endswith(('$', '${', '${#', '${!', '\\', '~')) or text[k + 1].startswith(('=', '+=', '(')): return None
+            column = columns.setdefault(part, len(columns) + 1)
+            script.append('${{QSB_TABLE_{}[{}-1]}}'.format(column, cls.array_variable))
+        return ''.join(script), list(columns.keys())
+    @classmethod
+    def formatArray(cls, sections, name):
+        """Format sections with the same arrayKey as a single task array named name, running one section per task.
+        Each task appends its output to the log files of its own section. If the section scripts differ only in their word values, the task array runs
+        a single script looking the values up in a table; otherwise, each task runs its own section script"""
+        output = list(cls.preamble)
+        output.extend(cls.arrayDirectives(name, len(sections)))
+        output.extend(cls.arrayKey(sections[0]))
+        output.append('{} -o {}'.format(cls.option_prefix, cls.arrayFilename(sections[0].outfile, name)))
+        output.append('{} -e {}'.format(cls.option_prefix, cls.arrayFilename(sections[0].errfile, name)))
+        table = cls.arrayTable(sections)
+        if table is not None:
+            script, columns = table
+            for column, values in enumerate(columns): output.append('QSB_TABLE_{}=({})'.format(column + 1, ' '.join(values)))
+            output.append(script)
+            return output
+        output.append('case ${} in'.format(cls.array_variable))
+        for i, section in enumerate(sections):
+            output.append('{})'.format(i + 1))
+            output.extend(['\t{}'.format(l) for l in cls.taskLines(section)])
+            output.append('\t;;')
+        output.append('esac')
         return output
+    @classmethod
+    def writeArray(cls, sections, name, output): cls.writeLines(cls.formatArray(sections, name), output)
+
+class BashFormatter(OutputFormatter):
+    status_logged = True
+    logged_requirements = frozenset([Requirement.PATH_READABLE, Requirement.PATH_WRITABLE, Requirement.PATH_EXECUTABLE, Requirement.ENV_SET, Requirement.ENV_UNSET])
+
+class QSUBFormatter(OutputFormatter):
+    option_prefix = '#$'
+    name_option = '-N'
+    limit_directive = '-l {}={}'
+    hold_directive = '-hold_jid {}'
+    array_option = '-t'
+    array_variable = 'SGE_TASK_ID'
+    array_task_id = '$TASK_ID'
+    logged_requirements = frozenset([Requirement.PATH_EXECUTABLE])
+    signal_traps = True
+    @classmethod
+    def arrayDirectives(cls, name, size): return ['{} -N {}'.format(cls.option_prefix, name), '{} -t 1-{}'.format(cls.option_prefix, size)]
 
 class LSFFormatter(OutputFormatter):
     option_prefix = '#BSUB'
+    name_option = '-J'
+    limit_directive = '-R "rusage[{}={}]"'
+    limit_directives = {'h_rt':'-W {1}', 'h_vmem':'-M {1}', 'mem_free':'-R "rusage[mem={1}]"'}
+    hold_directive = '-w "{}"'
+    hold_term = 'done({})'
+    hold_separator = ' && '
+    array_variable = 'LSB_JOBINDEX'
+    array_task_id = '%I'
+    logged_requirements = frozenset([Requirement.PATH_EXECUTABLE])
+    signal_traps = True
     @classmethod
-    def frontMatter(cls, section):
-        output = []
-        output.append('{} -J {}'.format(cls.option_prefix, section.name))
-        for limit, value in section.limits.limits.items():
-            output.append('{} -l {}={}'.format(cls.option_prefix, limit, value))
-        for option in section.options:
-            output.append('{} {}'.format(cls.option_prefix, str(option)))
-        for hold in section.holds:
-            output.append('{} -hold_jid {}'.format(cls.option_prefix, hold))
-        output.append('{} -o {}'.format(cls.option_prefix, section.outfile.getFilename(section.name)))
-        output.append('{} -e {}'.format(cls.option_prefix, section.errfile.getFilename(section.name)))
-        for requirement, name in section.requirements:
-            if requirement == Requirement.PATH_ABSENT: output.append('if ! test -e {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} exists'.format(name))))
-            if requirement == Requirement.PATH_PRESENT: output.append('if test -e {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not found'.format(name))))
-            if requirement == Requirement.PATH_READABLE: output.append('if ! test -r {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not readable'.format(name))))
-            if requirement == Requirement.PATH_WRITABLE: output.append('if ! test -w {0}; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not writable'.format(name))))
-            if requirement == Requirement.PATH_EXECUTABLE: output.append('if [ ! -x "$(command -v {0})" ]; then {1} >> {2}; exit 1; fi'.format(name, cls.echoString('ERROR: file {} not executable'.format(name)), section.errfile.getFilename(section.name)))
-            if requirement == Requirement.ENV_SET: output.append('if [ -z ${{{0}+x}} ]; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: environment variable {} not set'.format(name))))
-            if requirement == Requirement.ENV_UNSET: output.append('if [ -n ${{{0}+x}} ]; then {1}; exit 1; fi'.format(name, cls.echoString('ERROR: environment variable {} set'.format(name))))
-        if section.check is True:
-            output.append('on_stop() {{ {}; }}'.format(cls.echoString('imminent SIGSTOP (received SIGUSR1)')))
-            output.append('on_kill() {{ {}; }}'.format(cls.echoString('imminent SIGKILL (received SIGUSR2)')))
-            output.append('trap \'on_stop\' SIGUSR1')
-            output.append('trap \'on_kill\' SIGUSR2')
-        if section.log is True: output.append(cls.echoString('section {} started'.format(section.name)))
-        return output
+    def limitDirective(cls, limit, value):
+        # LSF run limits are given as [hours:]minutes, so any seconds are rounded up:
+        if limit == 'h_rt':
+            minutes = (cls.runLimitSeconds(value) + 59) // 60
+            value = '{}:{:02d}'.format(minutes // 60, minutes % 60)
+        return super().limitDirective(limit, value)
     @classmethod
-    def commands(cls, section):
-        output = []
-        for command in section.commands:
-            if command.include != True: continue
-            if command.cmdtype is CommandType.log_out:
-                output.append('{0} >> {1}'.format(cls.echoString('{}'.format(command.command)), section.outfile.getFilename(section.name)))
-            elif command.cmdtype is CommandType.log_err:
-                output.append('{0} >> {1}'.format(cls.echoString('{}'.format(command.command)), section.errfile.getFilename(section.name)))
-            else:
-                if command.log is True: output.append(cls.echoString('command {} started'.format(command.name)))
-                if command.test is True: output.append('{0} || {{ {1}; exit 1; }}'.format(command.command, cls.echoString('command {} failed'.format(command.name))))
-                else: output.append(command.command)
-                if command.log is True: output.append(cls.echoString('command {} completed'.format(command.name)))
-        return output
+    def arrayDirectives(cls, name, size): return ['{} -J "{}[1-{}]"'.format(cls.option_prefix, name, size)]
+
+class SlurmFormatter(OutputFormatter):
+    preamble = ('#!/bin/bash',)
+    option_prefix = '#SBATCH'
+    name_option = '-J'
+    limit_directive = '--{}={}'
+    limit_directives = {'h_rt':'--time={1}', 'h_vmem':'--mem={1}', 'mem_free':'--mem={1}'}
+    hold_directive = '--dependency=afterok:{}'
+    hold_separator = ':'
+    hold_job_ids = True
+    array_option = '--array'
+    array_variable = 'SLURM_ARRAY_TASK_ID'
+    array_task_id = '%a'
+    logged_requirements = frozenset([Requirement.PATH_EXECUTABLE])
     @classmethod
-    def endMatter(cls, section):
-        output = []
-        if section.log is True: output.append(cls.echoString('section {} completed'.format(section.name)))
-        return output
+    def limitDirective(cls, limit, value):
+        # SLURM reads a single number as minutes, so run limits are always written as hours:minutes:seconds:
+        if limit == 'h_rt':
+            seconds = cls.runLimitSeconds(value)
+            value = '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+        # Other limits are written as long options, so (for example) cpus_per_task=4 becomes --cpus-per-task=4:
+        if limit not in cls.limit_directives: limit = limit.replace('_', '-')
+        return super().limitDirective(limit, value)
+    @classmethod
+    def arrayDirectives(cls, name, size): return ['{} -J {}'.format(cls.option_prefix, name), '{} --array=1-{}'.format(cls.option_prefix, size)]
+
+class PBSFormatter(OutputFormatter):
+    option_prefix = '#PBS'
+    name_option = '-N'
+    limit_directive = '-l {}={}'
+    limit_directives = {'h_rt':'-l walltime={1}', 'h_vmem':'-l vmem={1}', 'mem_free':'-l mem={1}'}
+    hold_directive = '-W depend={}'
+    hold_job_ids = True
+    array_option = '-t'
+    array_variable = 'PBS_ARRAYID'
+    logged_requirements = frozenset([Requirement.PATH_EXECUTABLE])
+    @classmethod
+    def holdDirectives(cls, holds):
+        # Holds on task arrays (with IDs such as 123[]) need a separate dependency type:
+        jobs = [hold for hold in holds if '[]' not in hold]
+        arrays = [hold for hold in holds if '[]' in hold]
+        dependencies = []
+        if len(jobs) > 0: dependencies.append(':'.join(['afterok'] + jobs))
+        if len(arrays) > 0: dependencies.append(':'.join(['afterokarray'] + arrays))
+        if len(dependencies) == 0: return []
+        return [cls.hold_directive.format(','.join(dependencies))]
+    @classmethod
+    def arrayDirectives(cls, name, size): return ['{} -N {}'.format(cls.option_prefix, name), '{} -t 1-{}'.format(cls.option_prefix, size)]
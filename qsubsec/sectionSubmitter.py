@@ -13,23 +13,57 @@
 
 import logging as log
 import subprocess
+import asyncio
+import locale
+import time
+import re
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from threading import Lock, Thread
+
+class SkippedSectionError(Exception):
+    """
+    Raised (as a submission result) for a section that was not run because a section it holds on failed.
+    
+    :param name: The skipped section name.
+    :param failed: The names of the failed sections it holds on.
+    """
+    def __init__(self, name, failed):
+        super(SkippedSectionError, self).__init__('skipped because {} failed'.format(', '.join(failed)))
+        self.name = name
+        self.failed = failed
 
 class outputSubmitterBase(object):
-    pass
+    # Patterns matching the job ID in the output of the supported schedulers:
+    job_id_patterns = [re.compile(r'Your job(?:-array)? ([0-9]+)'), re.compile(r'Job <([0-9]+)> is submitted')]
+    @classmethod
+    def parseJobID(cls, output):
+        """Return the job ID reported in a scheduler's submission output (or None)"""
+        if output is None: return None
+        for pattern in cls.job_id_patterns:
+            match = pattern.search(output)
+            if match is not None: return match.group(1)
+        return None
 
 class outputSubmitterProc(outputSubmitterBase):
     @classmethod
-    def spawn(cls, proc_exec, data, timeout=None):
+    def spawn(cls, proc_exec, data, timeout=None, check=False):
         # Attempt to create the subprocess:
         log.info('spawning process "{}" using process submitter'.format(' '.join(proc_exec)))
         try:
             proc = subprocess.Popen(args=proc_exec, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
             log.debug('spawned subprocess pid {}'.format(proc.pid))
         except FileNotFoundError as err:
-            log.error(log, 'subprocess executable "{}" not found'.format(args[0]))
+            log.error('subprocess executable "{}" not found'.format(proc_exec[0]))
             raise err
         except Exception as err:
-            log.error(log, 'failed to spawn subprocess "{}"'.format(' '.join(proc_exec)))
+            log.error('failed to spawn subprocess "{}"'.format(' '.join(proc_exec)))
             raise err
         # Attempt to communicate with the subprocess:
         try:
@@ -37,6 +71,12 @@ class outputSubmitterProc(outputSubmitterBase):
             output_data = proc.communicate(input=data, timeout=timeout)
             if (output_data[0] != None) and (output_data[0] != ''): log.info('submission stdout: "{}"'.format(output_data[0].strip()))
             if (output_data[1] != None) and (output_data[1] != ''): log.info('submission stderr: "{}"'.format(output_data[1].strip()))
+            # If requested, treat a non-zero exit status as a failure:
+            if (check is True) and (proc.returncode != 0): raise subprocess.CalledProcessError(proc.returncode, proc_exec, output_data[0], output_data[1])
+            return output_data[0]
+        except subprocess.CalledProcessError as err:
+            log.warning('subprocess "{}" exited with status {}'.format(' '.join(proc_exec), err.returncode))
+            raise err
         except subprocess.TimeoutExpired as err:
             proc.kill()
             proc.communicate()
@@ -50,7 +90,7 @@ class outputSubmitterProc(outputSubmitterBase):
 
 class outputSubmitterShell(outputSubmitterBase):
     @classmethod
-    def spawn(cls, proc_exec, data, timeout=None):
+    def spawn(cls, proc_exec, data, timeout=None, check=False):
         proc_exec = ' '.join(proc_exec)
         # Attempt to create the subprocess:
         log.info('spawning process using "{}" shell ({} bytes)'.format(proc_exec, len(data)))
@@ -58,5 +98,271 @@ class outputSubmitterShell(outputSubmitterBase):
             pid = subprocess.Popen(args=data, executable=proc_exec, stdin=None, stdout=None, shell=True).pid
             log.debug('spawned "{}" shell pid {}'.format(proc_exec, pid))
         except Exception as err:
-            log.error(log, 'failed to run command in "{}" shell'.format(proc_exec))
+            log.error('failed to run command in "{}" shell'.format(proc_exec))
+            raise err
+
+class outputSubmitterAsync(outputSubmitterBase):
+    """This class runs submissions as asyncio subprocesses, so that many can run concurrently in a single thread.
+    The formatted section is passed to the executable on stdin, and its output is captured.
+    NB: As with outputSubmitterProc, stdin and stdout are encoded using the locale's preferred encoding"""
+    script_stdin = True
+    capture_output = True
+    @classmethod
+    async def spawnAsync(cls, proc_exec, data, timeout=None, check=False):
+        # Attempt to create the subprocess:
+        log.info('spawning process "{}" using asynchronous submitter'.format(' '.join(proc_exec)))
+        try:
+            if cls.script_stdin is True: proc = await asyncio.create_subprocess_exec(*proc_exec, stdin=subprocess.PIPE, stdout=subprocess.PIPE if cls.capture_output else None)
+            else: proc = await asyncio.create_subprocess_exec(*proc_exec, '-c', data, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE if cls.capture_output else None)
+            log.debug('spawned subprocess pid {}'.format(proc.pid))
+        except FileNotFoundError as err:
+            log.error('subprocess executable "{}" not found'.format(proc_exec[0]))
+            raise err
+        except Exception as err:
+            log.error('failed to spawn subprocess "{}"'.format(' '.join(proc_exec)))
             raise err
+        # Attempt to communicate with the subprocess:
+        encoding = locale.getpreferredencoding(False)
+        try:
+            if cls.script_stdin is True: log.debug('sending {} bytes to subprocess {}'.format(len(data), proc.pid))
+            output_data = await asyncio.wait_for(proc.communicate(input=data.encode(encoding) if cls.script_stdin else None), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.communicate()
+            log.warning('submission to subprocess "{}" timed out'.format(' '.join(proc_exec)))
+            raise subprocess.TimeoutExpired(proc_exec, timeout)
+        except BaseException as err:
+            proc.kill()
+            await proc.communicate()
+            log.warning('failed to submit job to subprocess "{}"'.format(' '.join(proc_exec)))
+            raise err
+        output = None
+        if output_data[0] is not None:
+            output = output_data[0].decode(encoding, errors='replace')
+            if output != '': log.info('submission stdout: "{}"'.format(output.strip()))
+        # If requested, treat a non-zero exit status as a failure:
+        if (check is True) and (proc.returncode != 0):
+            log.warning('subprocess "{}" exited with status {}'.format(' '.join(proc_exec), proc.returncode))
+            raise subprocess.CalledProcessError(proc.returncode, proc_exec, output)
+        return output
+    @classmethod
+    def spawn(cls, proc_exec, data, timeout=None, check=False):
+        return asyncio.run(cls.spawnAsync(proc_exec, data, timeout=timeout, check=check))
+
+class outputSubmitterAsyncShell(outputSubmitterAsync):
+    """This class runs formatted sections as asyncio shell subprocesses.
+    The formatted section is passed to the shell as a single command string, and its output is not captured"""
+    script_stdin = False
+    capture_output = False
+
+class outputSubmitterSlurm(outputSubmitterAsync):
+    """This class submits formatted sections to SLURM (using sbatch)"""
+    job_id_patterns = [re.compile(r'Submitted batch job ([0-9]+)')]
+
+class outputSubmitterPBS(outputSubmitterAsync):
+    """This class submits formatted sections to PBS/Torque (using qsub).
+    NB: The full job ID is reported (such as 123.server, or 123[].server for task arrays), as it is needed to hold on the job"""
+    job_id_patterns = [re.compile(r'^([0-9]+(?:\[\])?(?:\.\S+)?)\s*$', re.MULTILINE)]
+
+class SubmissionJournal(object):
+    """This class encapsulates an append-only journal of submitted sections.
+    Each line of the journal file is a JSON record holding the section name, the hash of its formatted script, the job ID (if known) and the submission time"""
+    @classmethod
+    def hashData(cls, data):
+        """Return the hash of a formatted section script"""
+        return hashlib.sha256(data.encode('UTF-8')).hexdigest()
+    def __init__(self, filename):
+        super(SubmissionJournal, self).__init__()
+        self.filename = filename
+        self._handle = None
+    def getFilename(self): return self._filename
+    def setFilename(self, filename): self._filename = filename
+    def iterRecords(self):
+        """Generate the records in the journal file.
+        NB: Invalid lines (for example, a partial record written when qsubsec was killed) are skipped"""
+        try: journal_file = open(self.filename, 'rt', encoding='UTF-8')
+        except FileNotFoundError: return
+        with journal_file:
+            for line_number, line in enumerate(journal_file):
+                try: record = json.loads(line)
+                except ValueError:
+                    log.warning('skipping invalid record on line {} of journal "{}"'.format(line_number + 1, self.filename))
+                    continue
+                yield record
+    def getHashes(self):
+        """Return the set of script hashes in the journal"""
+        return set([record.get('hash') for record in self.iterRecords()])
+    def getJobIDs(self):
+        """Return the job ID recorded for each script hash in the journal (the latest, if a script was submitted more than once)"""
+        return {record.get('hash'):record.get('job_id') for record in self.iterRecords()}
+    def record(self, name, data_hash, job_id=None):
+        """Append a record to the journal"""
+        if self._handle is None:
+            self._handle = open(self.filename, 'a+b')
+            # Terminate any partial record, so that it does not corrupt the new one:
+            if self._handle.tell() > 0:
+                self._handle.seek(-1, os.SEEK_END)
+                if self._handle.read(1) != b'\n': self._handle.write(b'\n')
+        record = OrderedDict([('name', name), ('hash', data_hash), ('job_id', job_id), ('time', datetime.now(timezone.utc).isoformat())])
+        self._handle.write('{}\n'.format(json.dumps(record)).encode('UTF-8'))
+        self._handle.flush()
+    def close(self):
+        """Close the journal file"""
+        if self._handle is not None: self._handle.close()
+        self._handle = None
+    filename = property(getFilename, setFilename, "The journal filename")
+    hashes = property(getHashes, None, "The script hashes in the journal")
+    job_ids = property(getJobIDs, None, "The job IDs in the journal, by script hash")
+
+class SubmissionRateLimiter(object):
+    """This class limits the rate at which submissions are started (to protect the scheduler)"""
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = Lock()
+        self._next = 0
+    def getRate(self): return self._rate
+    def setRate(self, rate):
+        if rate is None: self._rate = None
+        else: self._rate = float(rate)
+    def reserve(self):
+        """Reserve the next submission slot, returning the number of seconds to wait until it starts"""
+        if self.rate is None: return 0
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + (1.0 / self.rate)
+        return start - now
+    def wait(self):
+        """Wait until the next submission is allowed to start"""
+        delay = self.reserve()
+        if delay > 0: time.sleep(delay)
+    rate = property(getRate, setRate, "The maximum number of submissions started per second (or None for no limit)")
+
+class SubmissionPool(object):
+    """This class submits formatted sections concurrently using a submitter class.
+    Failed submissions (timeouts or, if check is True, non-zero exit statuses) are retried with exponential backoff.
+    If resolve is given, sections run by iterSpawnGraph are submitted as resolve(data, outputs, unmatched), where outputs are the
+    submission outputs of the sections it holds on, and unmatched are the holds that matched no earlier section"""
+    graph_window = 1024
+    def __init__(self, submitter, proc_exec, jobs=1, timeout=None, check=False, rate=None, retries=0, backoff=1.0, resolve=None):
+        super(SubmissionPool, self).__init__()
+        self.submitter = submitter
+        self.proc_exec = proc_exec
+        self.jobs = jobs
+        self.timeout = timeout
+        self.check = check
+        self.limiter = SubmissionRateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.resolve = resolve
+    def getJobs(self): return self._jobs
+    def setJobs(self, jobs): self._jobs = max(int(jobs), 1)
+    def getRetries(self): return self._retries
+    def setRetries(self, retries): self._retries = max(int(retries), 0)
+    def spawn(self, data, name=None):
+        """Submit a single formatted section (named name), retrying on failure"""
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try: return self.submitter.spawn(proc_exec=self.proc_exec, data=data, timeout=self.timeout, check=self.check)
+            except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as err:
+                if attempt == self.retries: raise err
+                delay = self.backoff * (2 ** attempt)
+                log.warning('retrying submission of {} in {:g} seconds (attempt {} of {})'.format(name or 'section', delay, attempt + 2, self.retries + 1))
+                time.sleep(delay)
+    async def spawnAsync(self, data, name, semaphore):
+        """Submit a single formatted section (named name) using an asynchronous submitter, retrying on failure"""
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                await asyncio.sleep(self.limiter.reserve())
+                try: return await self.submitter.spawnAsync(proc_exec=self.proc_exec, data=data, timeout=self.timeout, check=self.check)
+                except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as err:
+                    if attempt == self.retries: raise err
+                    delay = self.backoff * (2 ** attempt)
+                    log.warning('retrying submission of {} in {:g} seconds (attempt {} of {})'.format(name or 'section', delay, attempt + 2, self.retries + 1))
+                    await asyncio.sleep(delay)
+    async def spawnNode(self, data, name, semaphore, dependencies, unmatched=()):
+        """Submit a single formatted section once the sections it holds on have completed, skipping it if any of them failed"""
+        waiting = [asyncio.wrap_future(future) for hold, future in dependencies]
+        if len(waiting) > 0:
+            await asyncio.wait(waiting)
+            failed = list(OrderedDict.fromkeys([hold for (hold, future), w in zip(dependencies, waiting) if w.exception() is not None]))
+            if len(failed) > 0:
+                log.warning('skipping section {} ({} failed)'.format(name, ', '.join(failed)))
+                raise SkippedSectionError(name, failed)
+        if self.resolve is not None: data = self.resolve(data, [w.result() for w in waiting], list(unmatched))
+        return await self.spawnAsync(data, name, semaphore)
+    @contextmanager
+    def eventLoop(self):
+        """Run an event loop in a background thread, returning the loop and a semaphore limiting the concurrent submissions"""
+        loop = asyncio.new_event_loop()
+        loop_thread = Thread(target=loop.run_forever, daemon=True)
+        loop_thread.start()
+        async def newSemaphore(): return asyncio.Semaphore(self.jobs)
+        try: yield loop, asyncio.run_coroutine_threadsafe(newSemaphore(), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+    def iterSpawn(self, items):
+        """Submit a sequence of (name, data) pairs, yielding (name, result, error) triples in the same order.
+        Asynchronous submitters are run in an event loop in a single background thread; others are run in a thread pool.
+        NB: Only a few submissions per worker are queued at a time, so the items are consumed as the submissions complete"""
+        pending = deque()
+        def result():
+            name, future = pending.popleft()
+            try: return name, future.result(), None
+            except Exception as err: return name, None, err
+        if hasattr(self.submitter, 'spawnAsync'):
+            with self.eventLoop() as (loop, semaphore):
+                try:
+                    for name, data in items:
+                        pending.append((name, asyncio.run_coroutine_threadsafe(self.spawnAsync(data, name, semaphore), loop)))
+                        if len(pending) >= 2 * self.jobs: yield result()
+                    while len(pending) > 0: yield result()
+                finally:
+                    for name, future in pending: future.cancel()
+            return
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for name, data in items:
+                pending.append((name, pool.submit(self.spawn, data, name)))
+                if len(pending) >= 2 * self.jobs: yield result()
+            while len(pending) > 0: yield result()
+    def iterSpawnGraph(self, items):
+        """Run a sequence of (name, data, holds, members) tuples using an asynchronous submitter, yielding (name, result, error) triples in the same order.
+        Each section (or task array of the member sections) starts once the earlier sections matching its holds (section names or wildcard patterns) have completed.
+        Holds are matched against every member of a task array, not just the section naming it.
+        Sections that hold on a failed (or skipped) section are skipped, with a SkippedSectionError as their error.
+        Holds matching no earlier section are ignored, unless they are passed to the pool's resolve function.
+        NB: Sections waiting on their holds are queued, so up to graph_window sections are consumed ahead of the completed ones"""
+        pending = deque()
+        unfinished = set()
+        names = OrderedDict()
+        def result():
+            name, future = pending.popleft()
+            try: return name, future.result(), None
+            except Exception as err: return name, None, err
+        with self.eventLoop() as (loop, semaphore):
+            try:
+                for name, data, holds, members in items:
+                    # Find the earlier sections matching each hold (holding on a task array once, however many of its members match):
+                    dependencies = []
+                    unmatched = []
+                    for hold in holds:
+                        if any([c in hold for c in '*?[']): matches = [n for n in names if fnmatchcase(n, hold)]
+                        else: matches = [hold] if hold in names else []
+                        if len(matches) == 0:
+                            if self.resolve is not None: unmatched.append(hold)
+                            else: log.warning('section {} holds on unknown section {}; ignoring hold'.format(name, hold))
+                        for match in matches: dependencies.extend([(match, future) for future in names[match]])
+                    dependencies = list(OrderedDict([(future, (match, future)) for match, future in dependencies]).values())
+                    future = asyncio.run_coroutine_threadsafe(self.spawnNode(data, name, semaphore, dependencies, unmatched), loop)
+                    for member in members: names.setdefault(member, []).append(future)
+                    pending.append((name, future))
+                    unfinished.add(future)
+                    if len(unfinished) >= self.graph_window: unfinished = wait(unfinished, return_when=FIRST_COMPLETED).not_done
+                    while (len(pending) > 0) and pending[0][1].done(): yield result()
+                while len(pending) > 0: yield result()
+            finally:
+                for name, future in pending: future.cancel()
+    jobs = property(getJobs, setJobs, "The maximum number of concurrent submissions")
+    retries = property(getRetries, setRetries, "The number of times to retry a failed submission")
@@ -155,6 +155,9 @@ class CommandType(Enum):
     log_out = 'log_out'
     log_err = 'log_err'
 
+# A lookup of command types by value:
+command_types = {t.value:t for t in CommandType}
+
 class Command(object):
     def __init__(self, cmd, name=None, log=True, test=True, cmdtype=CommandType.command):
         self.cmdtype = cmdtype
@@ -184,6 +187,10 @@ class Command(object):
         output['test'] = self.test
         return output
     def asJSON(delf, indent=None): return json.dumps(self.asDict, indent=indent)
+    def __getstate__(self): return (self._cmdtype.value, self._command, self._name, self._log, self._test, self._include)
+    def __setstate__(self, state):
+        self._cmdtype = command_types[state[0]]
+        self._command, self._name, self._log, self._test, self._include = state[1:]
     command = property(getCommand, setCommand, doc='The QSUB command string')
     cmdtype = property(getType, setType, doc='The command type')
     log = property(getLog, setLog, doc='Should the command log its status?')
@@ -209,10 +216,11 @@ class CommandList(object):
         if not isinstance(new, Command): raise TypeError('invalid command type')
         self._commands.append(new)
     def newCommand(self, cmd, name=None, test=True, log=True, cmdtype=CommandType.command):
-        cmd_n = 0
-        for i in self.commands:
-            if i.cmdtype == CommandType.command: cmd_n += 1
-        if name == None: name = '{0}'.format(hex(cmd_n + 1))
+        if name == None:
+            cmd_n = 0
+            for i in self.commands:
+                if i.cmdtype == CommandType.command: cmd_n += 1
+            name = '{0}'.format(hex(cmd_n + 1))
         self.append(Command(cmd=cmd, name=name, test=test, log=log, cmdtype=cmdtype))
     def asList(self): return [c.asDict() for c in self.commands]
     def asJSON(self, indent=None): return json.dumps(self.asList(), indent=indent)
@@ -344,9 +352,23 @@ class SectionList(object):
     def __getitem__(self, key): return self.sections[key]
     def __delitem__(self, key): del(self.sections[key])
     def __iter__(self): return iter(self.sections)
-    def asJSON(self, indent=None):
-        output = [s.asDict() for s in self.sections]
-        return json.dumps(output, sort_keys=False, indent=indent)
+    def asJSON(self, indent=None): return ''.join(iterSectionJSON(self.sections, indent=indent))
     json = property(asJSON, None, "JSON representation of the section list")
     sections = property(getSections, setSections, "Return the section list")
     latest = property(getLatestSection, None, "Return the last section added")
+
+def iterSectionJSON(sections, indent=None):
+    """Generate the JSON representation of a sequence of sections one section at a time.
+    NB: The concatenated output is identical to dumping a list of the section dictionaries"""
+    if indent is None:
+        separator, start, end = ', ', '[', ']'
+    else:
+        if isinstance(indent, int): indent = ' ' * indent
+        separator, start, end = ',\n' + indent, '[\n' + indent, '\n]'
+    empty = True
+    for section in sections:
+        section_json = json.dumps(section.asDict(), sort_keys=False, indent=indent)
+        if indent is not None: section_json = section_json.replace('\n', '\n' + indent)
+        yield (start if empty is True else separator) + section_json
+        empty = False
+    yield '[]' if empty is True else end
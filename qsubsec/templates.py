@@ -17,8 +17,14 @@ from os import makedirs
 from os.path import expanduser, expandvars
 import logging as log
 import json
-from collections import OrderedDict
-from urllib.request import urlopen
+import ast
+import re
+import gc
+import pickle
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from qsubsec.urlFetcher import getDefaultFetcher
 
 class Template(object):
     @classmethod
@@ -27,9 +33,9 @@ class Template(object):
             input_string = input_file.read()
         return Template(string=input_string, formatter=formatter)
     @classmethod
-    def fromURL(cls, url, formatter=None, encoding='UTF-8'):
-        with urlopen(url) as input_url:
-            input_string = input_url.read().decode(encoding)
+    def fromURL(cls, url, formatter=None, encoding='UTF-8', fetcher=None):
+        if fetcher is None: fetcher = getDefaultFetcher()
+        input_string = fetcher.fetchText(url, encoding)
         return Template(string=input_string, formatter=formatter)
     def __init__(self, string=None, formatter=None):
         self.string = string
@@ -38,6 +44,7 @@ class Template(object):
         self._sections = SectionList()
     def getString(self): return self._string
     def setString(self, string):
+        self._compiled = None
         if string is None:
             self._string = None
         else:
@@ -46,48 +53,212 @@ class Template(object):
     def setFormatter(self, formatter): self._formatter = formatter
     def getSections(self): return self._sections
     def getStringTokens(self): return self.formatter.extractTokens(self.string)
-    def format(self, tokens):
+    def iterFormat(self, tokens):
         log.info('formatting template')
         if self.string is None: raise ValueError('template string unitialized')
-        return tokens.resolveString(self.string)
-    def execute(self, tokens):
+        return tokens.iterResolveString(self.string)
+    def format(self, tokens): return list(self.iterFormat(tokens))
+    def compileString(self):
+        """Compile the template once, with each token placeholder replaced by a lookup of the token value.
+        Returns None if any placeholder is outside a string literal (for example, in a name or number)"""
+        if self._compiled is not None: return self._compiled or None
+        self._compiled = False
+        literals, references = self.formatter.elementList(self.string).segments
+        # Mark each placeholder with a unique slot identifier:
+        prefix = 'QSBSLOT'
+        while prefix in self.string: prefix = '_{}'.format(prefix)
+        slot_re = re.compile('{}([0-9]+)_'.format(prefix))
+        probe = [literals[0]]
+        for i, literal in enumerate(literals[1:]): probe.extend(['{}{}_'.format(prefix, i), literal])
+        try: tree = ast.parse(''.join(probe), filename='<template>')
+        except SyntaxError: return None
+        # Placeholders can not be replaced within f-strings:
+        for node in ast.walk(tree):
+            if isinstance(node, ast.JoinedStr):
+                for value in node.values:
+                    if isinstance(value, ast.Constant) and (prefix in str(value.value)): return None
+        # Replace string constants containing slots with f-strings looking up the token values:
+        class SlotTransformer(ast.NodeTransformer):
+            def visit_Constant(self, node):
+                if (not isinstance(node.value, str)) or (prefix not in node.value): return node
+                parts = slot_re.split(node.value)
+                values = []
+                for i, part in enumerate(parts):
+                    if i % 2 == 0:
+                        if len(part) > 0: values.append(ast.Constant(value=part))
+                    else:
+                        lookup = ast.parse('__values__[{!r}]'.format(references[int(part)]), mode='eval').body
+                        values.append(ast.FormattedValue(value=lookup, conversion=-1, format_spec=None))
+                return ast.copy_location(ast.JoinedStr(values=values), node)
+        tree = ast.fix_missing_locations(SlotTransformer().visit(tree))
+        # Any remaining slot is in a syntactic position (a name, number, bytes literal etc.):
+        for node in ast.walk(tree):
+            for field, value in ast.iter_fields(node):
+                if isinstance(value, (str, bytes)) and (prefix.encode() if isinstance(value, bytes) else prefix) in value: return None
+        try: code = compile(tree, '<template>', 'exec')
+        except (SyntaxError, ValueError): return None
+        self._compiled = (code, literals, references)
+        return self._compiled
+    def iterSources(self, tokens):
+        """Generate the compiled template (or formatted template source) and the token value bindings for each token combination"""
+        if self.string is None: raise ValueError('template string unitialized')
+        compiled = self.compileString()
+        if compiled is None:
+            log.info('template has tokens outside string literals; formatting the template for each token combination')
+            for formatted_data in self.iterFormat(tokens): yield formatted_data, {}
+            return
+        log.info('executing compiled template')
+        code, literals, references = compiled
+        # Values that the Python parser would have interpreted (escapes or quotes) are formatted into the source instead:
+        unsafe = re.compile(r'[\\\'"\r\n]')
+        for values in tokens.iterResolveStringTokens(self.string):
+            if any([unsafe.search(values[r]) for r in set(references)]):
+                formatted_data = [literals[0]]
+                for reference, literal in zip(references, literals[1:]): formatted_data.extend([values[reference], literal])
+                yield ''.join(formatted_data), {}
+            else: yield code, values
+    def refersToSections(self):
+        """Does the template code refer to the defined sections (which it can then inspect or modify)?"""
+        return (self.string is not None) and ('__sections__' in self.string)
+    def getCombinations(self, tokens):
+        """Return the number of token combinations the template will be executed for"""
+        return tokens.countStringCombinations(self.string)
+    def getBindings(self, tokens, sections=None, isolated=False):
+        """Return the global names available to template code, adding new sections to sections (by default, the template sections).
+        If isolated is True, sections holds only the sections of the current combination, so modifying an earlier section is an error"""
+        if sections is None: sections = self.sections
+        def latestSection():
+            if len(sections) > 0: return sections.latest
+            if isolated is True: raise ValueError('template modifies a section defined for an earlier token combination, which is not supported when executing the template in parallel')
+            raise ValueError('template modifies a section before defining one')
         def QSBSection(name, description=None, check=True, log=True):
-            self.sections.newSection(name, description=description, check=check, log=log)
+            sections.newSection(name, description=description, check=check, log=log)
         def QSBValidate(path):
             try: makedirs(expandvars(expanduser(path)))
             except FileExistsError: pass
             except: raise Exception('Failed to create reference log directory {}'.format(path))
         def QSBLimits(**kwargs):
             for limit, value in kwargs.items():
-                self.sections.latest.limits[limit] = value
+                latestSection().limits[limit] = value
         def QSBOptions(*args):
             for option_string in args:
-                self.sections.latest.options.append(Option.fromString(option_string))
+                latestSection().options.append(Option.fromString(option_string))
         def QSBHold(*args):
             for hold_string in args:
-                self.sections.latest.holds.append(hold_string)
+                latestSection().holds.append(hold_string)
         def QSBRequire(requirement, requirement_type):
-                self.sections.latest.requirements.append(requirement, requirement_type)
+                latestSection().requirements.append(requirement, requirement_type)
         def QSBOutfile(path, name=None):
-            self.sections.latest.outfile.path = path
-            self.sections.latest.outfile.name = name
+            latestSection().outfile.path = path
+            latestSection().outfile.name = name
         def QSBErrfile(path, name=None):
-            self.sections.latest.errfile.path = path
-            self.sections.latest.errfile.name = name
+            latestSection().errfile.path = path
+            latestSection().errfile.name = name
         def QSBOutputs(path, validate=True):
-            self.sections.latest.outfile.path = path
-            self.sections.latest.errfile.path = path
+            latestSection().outfile.path = path
+            latestSection().errfile.path = path
             if validate is True: QSBValidate(path)
         def QSBCommand(cmd, name=None, test=True, log=True):
-            self.sections.latest.commands.newCommand(cmd=cmd, name=name, test=test, log=log, cmdtype=CommandType.command)
+            latestSection().commands.newCommand(cmd=cmd, name=name, test=test, log=log, cmdtype=CommandType.command)
         def QSBLogOutput(message):
-            self.sections.latest.commands.newCommand(cmd=message, name=None, test=False, log=False, cmdtype=CommandType.log_out)            
+            latestSection().commands.newCommand(cmd=message, name=None, test=False, log=False, cmdtype=CommandType.log_out)            
         def QSBLogError(message):
-            self.sections.latest.commands.newCommand(cmd=message, name=None, test=False, log=False, cmdtype=CommandType.log_err)
-        for formatted_data in self.format(tokens):
-            log.info('executing formatted template')
-            exec(formatted_data, {'__sections__':self.sections, '__tokens__':tokens, 'section':QSBSection, 'validate': QSBValidate, 'limits':QSBLimits, 'options':QSBOptions, 'hold':QSBHold, 'require':QSBRequire, 'outputFile':QSBOutfile, 'errorFile':QSBErrfile, 'outputs':QSBOutputs, 'command':QSBCommand, 'message':QSBLogOutput, 'error':QSBLogError})
+            latestSection().commands.newCommand(cmd=message, name=None, test=False, log=False, cmdtype=CommandType.log_err)
+        return {'__sections__':sections, '__tokens__':tokens, 'section':QSBSection, 'validate': QSBValidate, 'limits':QSBLimits, 'options':QSBOptions, 'hold':QSBHold, 'require':QSBRequire, 'outputFile':QSBOutfile, 'errorFile':QSBErrfile, 'outputs':QSBOutputs, 'command':QSBCommand, 'message':QSBLogOutput, 'error':QSBLogError}
+    def executeSource(self, source, values, bindings):
+        """Execute the template code (or formatted source) for a single token combination"""
+        log.debug('executing template')
+        template_globals = dict(bindings)
+        template_globals['__values__'] = values
+        exec(source, template_globals)
+    def execute(self, tokens, jobs=1):
+        """Execute the template for each token combination, adding the resulting sections.
+        If jobs is greater than one, the combinations are executed in a pool of worker processes"""
+        # NB: Adding many long-lived objects triggers repeated full garbage collections; pausing collection avoids them:
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for combination, section in self.iterExecute(tokens, jobs=jobs): self.sections.append(section)
+        finally:
+            if gc_enabled is True: gc.enable()
+    def iterExecute(self, tokens, jobs=1):
+        """Execute the template for each token combination in turn, yielding (combination, section) pairs as they are generated.
+        The sections are not added to the template sections. If jobs is greater than one, the combinations are executed in a pool of worker processes.
+        NB: Template code can modify the latest section (even if defined for an earlier combination), so it is only yielded once a new section is defined.
+        Templates referring to __sections__ can modify any section, so no sections are yielded until the template has been executed for every combination"""
+        if self.refersToSections() is True:
+            if jobs > 1: log.warning('template refers to __sections__; executing the template in a single process')
+            combinations = {}
+            sections = SectionList()
+            bindings = self.getBindings(tokens, sections)
+            for combination, (source, values) in enumerate(self.iterSources(tokens)):
+                first = len(sections)
+                self.executeSource(source, values, bindings)
+                for section in sections[first:]: combinations.setdefault(id(section), combination)
+            # NB: The combination is only used to estimate progress, so sections the template has moved are not tracked:
+            for section in sections: yield combinations.get(id(section), 0), section
+            return
+        if jobs > 1:
+            yield from self.iterExecuteParallel(tokens, jobs)
+            return
+        sections = SectionList()
+        bindings = self.getBindings(tokens, sections)
+        pending = deque()
+        for combination, (source, values) in enumerate(self.iterSources(tokens)):
+            first = len(sections)
+            self.executeSource(source, values, bindings)
+            pending.extend([(combination, section) for section in sections[first:]])
+            while len(pending) > 1: yield pending.popleft()
+            del sections[:-1]
+        yield from pending
+    def iterExecuteParallel(self, tokens, jobs, chunk_size=64):
+        """Execute the template in worker processes, yielding (combination, section) pairs in combination order.
+        NB: Only a few chunks per worker are queued at a time, so the combinations are resolved as the sections are consumed"""
+        compiled = self.compileString()
+        def iterChunks():
+            chunk = []
+            for source, values in self.iterSources(tokens):
+                # NB: code objects can not be pickled, so the workers compile the template themselves:
+                if (compiled is not None) and (source is compiled[0]): source = None
+                chunk.append((source, values))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if len(chunk) > 0: yield chunk
+        log.info('executing template in {} worker processes'.format(jobs))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=initTemplateWorker, initargs=(self.string, self.formatter, tokens)) as pool:
+            pending = deque()
+            chunks = iterChunks()
+            first = 0
+            while True:
+                for chunk in islice(chunks, (jobs * 4) - len(pending)):
+                    pending.append((first, pool.submit(executeTemplateChunk, chunk)))
+                    first += len(chunk)
+                if len(pending) == 0: break
+                first_combination, future = pending.popleft()
+                for combination, section in pickle.loads(future.result()): yield first_combination + combination, section
     formatter = property(getFormatter, setFormatter, "Formatter used for parsing tokens")
     sections = property(getSections, None, "The template sections")
     string = property(getString, setString, "The template string")
     tokens = property(getStringTokens, None, "The tokens referred to in the string")
+
+# The template and tokens used by a worker process:
+_worker_state = None
+
+def initTemplateWorker(string, formatter, tokens):
+    """Initialise a template worker process"""
+    global _worker_state
+    _worker_state = (Template(string=string, formatter=formatter), tokens)
+
+def executeTemplateChunk(sources):
+    """Execute the template for a chunk of token combinations, returning the resulting sections (pickled)"""
+    template, tokens = _worker_state
+    sections = SectionList()
+    bindings = template.getBindings(tokens, sections, isolated=True)
+    output = []
+    for combination, (source, values) in enumerate(sources):
+        if source is None: source = template.compileString()[0]
+        template.executeSource(source, values, bindings)
+        for section in sections: output.append((combination, section))
+        del sections[:]
+    return pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
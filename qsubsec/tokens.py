@@ -11,14 +11,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from weakref import WeakSet
 from string import Formatter
 from itertools import product
+from math import prod
 from copy import deepcopy
-from sys import getrecursionlimit
+from sys import getrecursionlimit, intern
 import json
+import re
+import os
+import hashlib
+import pickle
+import tempfile
+from mmap import mmap, ACCESS_READ
+from locale import getpreferredencoding
 from pyparsing import *
-from urllib.request import urlopen
+from qsubsec.urlFetcher import getDefaultFetcher
 import logging as log
 
 class TokenError(Exception):
@@ -48,6 +57,46 @@ class CyclicTokenDependencyError(TokenError):
     """
     pass
 
+class TFFError(Exception):
+    """
+    The base class for TFF parsing exceptions.
+    """
+    pass
+
+class TFFSyntaxError(TFFError):
+    """
+    Raised when a line of a TFF string can not be parsed.
+    
+    :param line: The line number of the invalid line.
+    :param text: The text of the invalid line.
+    """
+    def __init__(self, line, text):
+        super(TFFSyntaxError, self).__init__('invalid TFF syntax on line {}: "{}"'.format(line, text))
+        self.line = line
+        self.text = text
+
+class TFFImportCycleError(TFFError):
+    """
+    Raised when a TFF file (indirectly) imports itself.
+    
+    :param files: The chain of imported files, starting and ending with the same file.
+    """
+    def __init__(self, files):
+        super(TFFImportCycleError, self).__init__('cyclic TFF import: "{}"'.format('" -> "'.join(files)))
+        self.files = files
+
+class TFFRecursionError(TFFError):
+    """
+    Raised when TFF imports are nested more deeply than the parser's recursion limit.
+    
+    :param limit: The parser recursion limit.
+    :param filename: The file that exceeded the limit.
+    """
+    def __init__(self, limit, filename):
+        super(TFFRecursionError, self).__init__('TFF imports nested more than {} deep importing "{}"'.format(limit, filename))
+        self.limit = limit
+        self.filename = filename
+
 class TokenFormatter(Formatter):
     """
     The TokenFormatter class extracts tokens from raw strings.
@@ -66,14 +115,18 @@ class TokenFormatter(Formatter):
         return tokens
     def elementList(self, string):
         """Converts a string into an ElementList."""
-        output = ElementList()
+        literals = ['']
+        references = []
         for i in self.parse(string):
-            if len(i[0]) != 0: output.append(SRef(i[0]))
-            if i[1] != None: output.append(TRef(i[1]))
-        return(output)
+            literals[-1] += i[0]
+            if i[1] != None:
+                references.append(i[1])
+                literals.append('')
+        return ElementList.fromSegments(literals, references)
 
 class TElement(object):
     """This class encapsulates a single part of a token string."""
+    __slots__ = ('_value',)
     def __init__(self, value): self.value = value
     def getValue(self): return self._value
     def setValue(self, value): self._value = str(value)
@@ -83,93 +136,184 @@ class TElement(object):
 
 class SRef(TElement):
     """This class encapsulates a simple Token string element"""
+    __slots__ = ()
     def __init__(self, value): super().__init__(value)
 
 class TRef(TElement):
     """This class encapsulates a simple Token reference element"""
+    __slots__ = ()
     def __init__(self, value): super().__init__(value)
+    def setValue(self, value): self._value = intern(str(value))
     def __str__(self): return '{{{}}}'.format(self.value)
+    value = property(TElement.getValue, setValue, "return the element value")
+
+class CompiledElementList(object):
+    """This class encapsulates an ElementList compiled to literal segments and token value slots"""
+    __slots__ = ('_literals', '_slots', '_pairs')
+    def __init__(self, literals, slots):
+        if len(literals) != len(slots) + 1: raise ValueError('invalid compiled element list')
+        self._literals = tuple(literals)
+        self._slots = tuple(slots)
+        self._pairs = tuple(zip(self._slots, self._literals[1:]))
+    def getLiterals(self): return self._literals
+    def getSlots(self): return self._slots
+    def substitute(self, values):
+        """Join the literal segments with the values held in the slots of a sequence of resolved values"""
+        if len(self._pairs) == 0: return self._literals[0]
+        output = [self._literals[0]]
+        for slot, literal in self._pairs:
+            output.append(values[slot])
+            output.append(literal)
+        return ''.join(output)
+    def __repr__(self): return 'CompiledElementList({}, {})'.format(self.literals, self.slots)
+    literals = property(getLiterals, None, "The literal segments surrounding the slots")
+    slots = property(getSlots, None, "The token value slot indices")
 
 class ElementList(object):
-    """This class encapsulates an ordered list of elements"""
+    """This class encapsulates an ordered list of elements.
+    NB: The elements are stored as a tuple of (interned) literal segments surrounding a tuple of token references.
+    Reference tuples are shared between all ElementLists that refer to the same tokens"""
+    __slots__ = ('_literals', '_references')
+    _reference_tuples = {}
+    @classmethod
+    def shareReferences(cls, references):
+        """Return the shared tuple for a sequence of token references"""
+        references = tuple([intern(str(r)) for r in references])
+        return cls._reference_tuples.setdefault(references, references)
+    @classmethod
+    def fromSegments(cls, literals, references):
+        """Create an ElementList from its literal segments and the token references between them"""
+        if len(literals) != len(references) + 1: raise ValueError('invalid element list segments')
+        output = ElementList()
+        output._literals = tuple([intern(l) for l in literals])
+        output._references = cls.shareReferences(references)
+        return output
     def __init__(self):
-        self.elements = []
+        self._literals = ('',)
+        self._references = ()
     def append(self, element):
         if not isinstance(element, TElement): raise ValueError('invalid element type')
-        self._elements.append(element)
-    def getElements(self): return self._elements
+        if isinstance(element, TRef):
+            self._references = self.shareReferences(self._references + (element.value,))
+            self._literals = self._literals + ('',)
+        else: self._literals = self._literals[:-1] + (intern(self._literals[-1] + element.value),)
+    def getElements(self):
+        """Return the elements as a list of SRef and TRef objects"""
+        output = []
+        for literal, reference in zip(self._literals, self._references + (None,)):
+            if len(literal) != 0: output.append(SRef(literal))
+            if reference is not None: output.append(TRef(reference))
+        return output
     def setElements(self, elements=[]):
-        self._elements = []
+        self._literals = ('',)
+        self._references = ()
         for element in elements: self.append(element)
+    def getSegments(self):
+        """Return the literal segments and the token references between them"""
+        return (self._literals, self._references)
+    def compile(self, index):
+        """Compile the element list against a dictionary mapping token names to value slot indices"""
+        try: return CompiledElementList(self._literals, [index[r] for r in self._references])
+        except KeyError as error: raise MissingTokenError(', '.join(error.args))
     def asJSON(self): return json.dumps(str(self))
     def __str__(self): return ''.join([str(x) for x in self.elements])
     def __repr__(self): return 'ElementList("{}")'.format(str(self))
     def __getitem__(self, name): return self.elements[name]
-    def __delitem__(self, name): del(self.elements[name])
+    def __delitem__(self, name):
+        elements = self.elements
+        del(elements[name])
+        self.elements = elements
     def __iter__(self): return iter(self.elements)
-    def getDependencies(self):
-        dependencies = set()
-        for element in self.elements:
-            if isinstance(element, TRef): dependencies.add(element.value)
-        return(dependencies)
+    def __getstate__(self): return (self._literals, self._references)
+    def __setstate__(self, state):
+        self._literals = tuple([intern(l) for l in state[0]])
+        self._references = self.shareReferences(state[1])
+    def getDependencies(self): return set(self._references)
     elements = property(getElements, setElements, "Return the element list")
+    segments = property(getSegments, None, "The literal segments and token references")
     dependencies = property(getDependencies, None, "Return the token dependencies")
     json = property(asJSON, None, "JSON representation of the element list")
 
 class Token(object):
     """This class encapsulates a token which can take one or more values"""
+    __slots__ = ('_name', '_values', '_owners')
     @classmethod
-    def fromFile(cls, name, filename, simple=False):
-        values = []
-        with open(filename, 'rt') as file_handle:
-            for line in file_handle.readlines():
-                line = line.strip()
-                if ((len(line) == 0) or line.startswith('#')) and (simple is False): continue
-                values.append(line)
-        return Token(name=name, values=values)
+    def fromLines(cls, name, lines, simple=False, encoding='UTF-8'):
+        """Create a token from an iterable of byte strings, one value per line"""
+        token = Token(name=name)
+        for line in lines:
+            line = line.decode(encoding).strip()
+            if ((len(line) == 0) or line.startswith('#')) and (simple is False): continue
+            token._append(line)
+        return token
     @classmethod
-    def fromURL(cls, name, url, simple=False, encoding='UTF-8'):
-        values = []
-        with urlopen(url) as url_handle:
-            for line in url_handle.readlines():
-                line = line.strip().decode(encoding)
-                if ((len(line) == 0) or line.startswith('#')) and (simple is False): continue
-                values.append(line)
-        return Token(name=name, values=values)
+    def fromFile(cls, name, filename, simple=False, encoding=None):
+        if encoding is None: encoding = getpreferredencoding(False)
+        with open(filename, 'rb') as file_handle:
+            # Empty files can not be memory-mapped:
+            if os.fstat(file_handle.fileno()).st_size == 0: return Token(name=name)
+            with mmap(file_handle.fileno(), 0, access=ACCESS_READ) as file_map:
+                return cls.fromLines(name, iter(file_map.readline, b''), simple=simple, encoding=encoding)
+    @classmethod
+    def fromURL(cls, name, url, simple=False, encoding='UTF-8', fetcher=None):
+        if fetcher is None: fetcher = getDefaultFetcher()
+        return cls.fromLines(name, fetcher.fetch(url).splitlines(), simple=simple, encoding=encoding)
     def __init__(self, name, values=[]):
         super(Token, self).__init__()
+        self._owners = WeakSet()
         self.name = name
         self.values = values
     def getName(self): return self._name
     def getValues(self): return self._values
-    def setName(self, name): self._name = str(name)
-    def add(self, value, formatter=None):
-        if formatter is None: formatter = TokenFormatter()
-        self._values.append(formatter.elementList(value))
+    def setName(self, name):
+        self._name = intern(str(name))
+        self.changed(renamed=True)
+    def add(self, value, formatter=None, literal=False):
+        self._append(value, formatter=formatter, literal=literal)
+        self.changed()
+    def _append(self, value, formatter=None, literal=False):
+        """Add a value without notifying the TokenSets holding the token (the caller must call changed() once done).
+        NB: Values without token references are stored as plain strings; only values containing braces are parsed to ElementLists"""
+        if (literal is True) or (('{' not in value) and ('}' not in value)): self._values.append(value)
+        else:
+            if formatter is None: formatter = TokenFormatter()
+            self._values.append(formatter.elementList(value))
     def setValues(self, values):
         self._values = []
-        for value in values: self.add(str(value))
+        for value in values: self._append(str(value))
+        self.changed()
+    def changed(self, renamed=False):
+        """Notify the TokenSets holding the token that it has been modified"""
+        if len(self._owners) == 0: return
+        for owner in list(self._owners): owner.invalidate(None if renamed else self.name)
     def getDependencies(self):
         dependencies = set()
         for value in self.values:
-            dependencies |= value.dependencies
+            if type(value) is not str: dependencies |= value.dependencies
         return dependencies
     def __len__(self): return len(self.values)
     def isIterated(self): return len(self) > 1
     def isSingle(self): return len(self) == 1
     def isEmpty(self): return len(self) < 1
-    def asJSON(self): return '{}: [{}]'.format(json.dumps(self.name), ', '.join([i.json for i in self.values]))
-    def asTFF(self): return '"{}" = {}'.format(self.name, ', '.join([i.json for i in self.values]))
+    def asJSON(self): return '{}: [{}]'.format(json.dumps(self.name), ', '.join([json.dumps(str(i)) for i in self.values]))
+    def asTFF(self): return '"{}" = {}'.format(self.name, ', '.join([json.dumps(str(i)) for i in self.values]))
     def asText(self): return '{} ("{}")'.format(self.name, '", "'.join([str(i) for i in self.values]))
     def __iter__(self): return iter(self.values)
     def __getitem__(self, name): return self.values[name]
-    def __delitem__(self, name): del(self.values[name])
+    def __delitem__(self, name):
+        del(self.values[name])
+        self.changed()
+    def __getstate__(self): return {'_name':self._name, '_values':self._values}
+    def __setstate__(self, state):
+        self._name = intern(state['_name'])
+        self._values = state['_values']
+        self._owners = WeakSet()
     def __repr__(self):
         if len(self) > 0: value_str = ', '.join(['"{}"'.format(i) for i in self.values])
         else: value_str = ''
         return 'Token("{}", [{}])'.format(self.name, value_str)
     name = property(getName, setName, "The token name")
-    values = property(getValues, setValues, "The values the token can take")
+    values = property(getValues, setValues, "The values the token can take (values without token references are plain strings)")
     iterated = property(isIterated, "Is this an iterated token?")
     single = property(isSingle, "Does the token have a single value?")
     empty = property(isEmpty, "Is this token empty?")
@@ -177,21 +321,160 @@ class Token(object):
     tff = property(asTFF, None, "TFF representation of the token")
     dependencies = property(getDependencies, None, "Return the token dependencies")
 
+class DependencyIndex(object):
+    """This class encapsulates the dependency graph of a TokenSet at a given version"""
+    def __init__(self, token_set):
+        super(DependencyIndex, self).__init__()
+        self._version = token_set.version
+        self._names = token_set.names
+        # Build the adjacency & reverse adjacency:
+        self._graph = OrderedDict()
+        self._dependents = {t:set() for t in self._names}
+        self._dependencies = set()
+        for t in self._names:
+            deps = frozenset(token_set[t].dependencies)
+            self._graph[t] = deps
+            self._dependencies |= deps
+            for d in deps & self._dependents.keys(): self._dependents[d].add(t)
+        self._external = self._dependencies - self._dependents.keys()
+        self._independent = set([t for t in self._names if len(self._graph[t]) == 0])
+        self._order = self.buildOrder()
+        self._components = self.buildComponents()
+        self._closures = {}
+    def buildOrder(self):
+        """Order the token names so that every token follows its internal dependencies"""
+        waiting = {t:len(self._graph[t] & self._dependents.keys()) for t in self._names}
+        ready = deque([t for t in self._names if waiting[t] == 0])
+        output = []
+        while len(ready) > 0:
+            t = ready.popleft()
+            output.append(t)
+            for d in self._dependents[t]:
+                waiting[d] -= 1
+                if waiting[d] == 0: ready.append(d)
+        return output
+    def buildComponents(self):
+        """Find the strongly connected components of the graph (Tarjan's algorithm, without recursion)"""
+        components = []
+        component_of = {}
+        number = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        for root in self._names:
+            if root in number: continue
+            work = [(root, iter(self._graph[root] & self._dependents.keys()))]
+            number[root] = low[root] = len(number)
+            stack.append(root)
+            on_stack.add(root)
+            while len(work) > 0:
+                node, children = work[-1]
+                for child in children:
+                    if child not in number:
+                        number[child] = low[child] = len(number)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self._graph[child] & self._dependents.keys())))
+                        break
+                    if child in on_stack: low[node] = min(low[node], number[child])
+                else:
+                    work.pop()
+                    if len(work) > 0: low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                    if low[node] == number[node]:
+                        component = set()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.add(member)
+                            component_of[member] = len(components)
+                            if member == node: break
+                        components.append(frozenset(component))
+        self._component_of = component_of
+        return components
+    def getVersion(self): return self._version
+    def getNames(self): return self._names
+    def getGraph(self): return self._graph
+    def getDependents(self, name):
+        """Get the tokens that directly depend on a single token"""
+        return self._dependents.get(name, set())
+    def getDependencies(self): return self._dependencies
+    def getExternalDependencies(self): return self._external
+    def getIndependentTokens(self): return self._independent
+    def getOrder(self): return self._order
+    def getCyclicTokens(self): return set(self._names) - set(self._order)
+    def getComponents(self): return self._components
+    def getClosure(self, name):
+        """Get the entire dependency set (recursively) for a single token, including the token itself if it is cyclic"""
+        if name not in self._graph: return frozenset()
+        # Work through the component graph, finding the closures of dependency components first:
+        target = self._component_of[name]
+        if target not in self._closures:
+            pending = [target]
+            while len(pending) > 0:
+                c = pending[-1]
+                deps = set()
+                for member in self._components[c]: deps |= self._graph[member]
+                missing = [self._component_of[d] for d in deps if (d in self._component_of) and (self._component_of[d] != c) and (self._component_of[d] not in self._closures)]
+                if len(missing) > 0:
+                    pending.extend(missing)
+                    continue
+                pending.pop()
+                if c in self._closures: continue
+                closure = set(deps)
+                for d in deps:
+                    if (d in self._component_of) and (self._component_of[d] != c): closure |= self._closures[self._component_of[d]]
+                self._closures[c] = frozenset(closure)
+        return self._closures[target]
+    version = property(getVersion, None, "The TokenSet version the index was built from")
+    names = property(getNames, None, "The token names in definition order")
+    graph = property(getGraph, None, "The token dependency adjacency")
+    dependencies = property(getDependencies, None, "All token dependencies")
+    external = property(getExternalDependencies, None, "The external token dependencies")
+    independent = property(getIndependentTokens, None, "The tokens without dependencies")
+    order = property(getOrder, None, "The resolvable tokens in dependency order")
+    cyclic = property(getCyclicTokens, None, "The tokens that form or depend on a cycle")
+    components = property(getComponents, None, "The strongly connected components of the graph")
+
 class TokenSet(object):
     """This class encapsulates a set of Tokens"""
     def __init__(self, formatter=None):
         super(TokenSet, self).__init__()
         if formatter == None: self.formatter = TokenFormatter()
         else: self.formatter = formatter
+        self._version = 0
+        self._index = None
+        self._stamps = {}
+        self._resolved = {}
+        self._positions = {}
+        self._next_position = 0
         self._tokens = OrderedDict()
     def getFormatter(self): return self._formatter
     def setFormatter(self, formatter): self._formatter = formatter
+    def getVersion(self): return self._version
+    def invalidate(self, name=None):
+        """Discard the cached dependency index after the TokenSet (or one of its tokens) changes.
+        If the changed token name is given, only resolved strings that depend on it are discarded"""
+        self._version += 1
+        self._index = None
+        if name is None: self._resolved = {}
+        else: self._stamps[name] = self._version
+    def getIndex(self):
+        """Return the dependency index for the current TokenSet version, rebuilding it if necessary"""
+        if self._index is None: self._index = DependencyIndex(self)
+        return self._index
     def add(self, token):
         """Add a single Token to the TokenSet"""
         assert(isinstance(token, Token))
-        if token.name in self.names:
+        if token.name in self._tokens:
             log.debug('redefining existing token {} ("{}" -> "{}")'.format(token.name, '", "'.join([str(i) for i in self.tokens[token.name].values]), '", "'.join([str(i) for i in token.values])))
+            self._tokens[token.name]._owners.discard(self)
+        else:
+            # NB: Positions are never reused (even after a token is removed), so they always follow the definition order:
+            self._positions[token.name] = self._next_position
+            self._next_position += 1
         self._tokens[token.name] = token
+        token._owners.add(self)
+        self.invalidate(token.name)
         # log.debug('added token {}'.format(token.asText()))
     def extend(self, token_set):
         """Extent the TokenSet by adding all tokens from a second TokenSet"""
@@ -200,66 +483,46 @@ class TokenSet(object):
     def getTokens(self): return self._tokens
     def setTokens(self, tokens):
         """Set the Tokens in the TokenSet"""
+        for token in self._tokens.values(): token._owners.discard(self)
         self._tokens = OrderedDict()
+        self._positions = {}
+        self.invalidate()
         for token in tokens: self.add(token)
     def getNames(self): return list(self.tokens.keys())
     def getDependencies(self):
         """Get all dependencies (internal & external) referenced by tokens in the TokenSet"""
-        output = set()
-        for t in self.names: output |= self[t].dependencies
-        return output
+        return set(self.index.dependencies)
     def getInternalDependencies(self):
         """Get all internal dependencies (i.e. tokens that are also in this TokenSet) referenced by tokens in the TokenSet"""
-        return self.getDependencies() & set(self.names)
+        return self.index.dependencies - self.index.external
     def getExternalDependencies(self):
         """Get all external dependencies (i.e. tokens that are not in this TokenSet) referenced by tokens in the TokenSet"""
-        return self.getDependencies() - set(self.names)
+        return set(self.index.external)
     def getTokenDependencies(self, name):
         """Get the entire dependency set (recursively) for a single token"""
-        output = set([name])
-        while True:
-            new_deps = set()
-            for new_dep in (output & set(self.names)):
-                new_deps |= self[new_dep].dependencies - output
-            if len(new_deps) == 0: break
-            output |= new_deps
-        return output - set([name])
+        return set(self.index.getClosure(name)) - set([name])
     def getIndependentTokens(self):
         """Get all tokens in the TokenSet that have no dependencies"""
-        output = set()
-        for t in self.names:
-            if len(self[t].dependencies) == 0: output |= set([t])
-        return(output)
+        return set(self.index.independent)
     def getDependentTokens(self):
         """Get all tokens in the TokenSet that have dependencies"""
-        return set(self.names) - self.getIndependentTokens()
+        return set(self.names) - self.index.independent
     def getDependencyGraph(self):
         """Return a simple graph object representing the TokenSet dependencies"""
         output = {}
-        for t in self.names:
-            output[t] = self.tokens[t].dependencies
+        for t, deps in self.index.graph.items(): output[t] = set(deps)
         return output
     def getCyclicDependencyGraph(self):
         """Prune leaf tokens from the TokenSet dependency graph, leaving the subgraph that contains cyclic dependencies.
         NB: external token dependencies are treated as leaves"""
-        g = self.getDependencyGraph()
-        all_nodes = set(self.names) | self.getDependencies()
-        all_leaves = set()
-        while True:
-            leaves = set()
-            # Identify leaves:
-            for node in all_nodes:
-                if (node not in g.keys()) or (len(g[node]) == 0):
-                    leaves |= set([node])
-                    for i in g.keys(): g[i] -= set([node])
-            # Remove empty nodes:
-            for leaf in leaves:
-                if leaf in g.keys():
-                    del g[leaf]
-            all_leaves |= leaves
-            all_nodes -= leaves
-            # Determine if we need another round:
-            if (len(leaves) == 0) or (len(g) == 0): return((g, all_leaves))
+        cyclic = self.index.cyclic
+        g = {t:set(self.index.graph[t] & cyclic) for t in cyclic}
+        all_leaves = (set(self.index.names) | self.index.dependencies) - cyclic
+        return((g, all_leaves))
+    def getResolutionOrder(self):
+        """Return the token names ordered so that every token follows its internal dependencies"""
+        if len(self.index.order) != len(self.index.names): raise CyclicTokenDependencyError(self.index.cyclic)
+        return list(self.index.order)
     def getSubgraph(self, name):
         """Return the minimal connected subgraph of the TokenSet based on the given token name"""
         output = TokenSet()
@@ -269,64 +532,144 @@ class TokenSet(object):
         return(output)
     def isComplete(self):
         """Check if the TokenSet is complete (i.e. has no external dependencies)"""
-        return len(self.getExternalDependencies()) == 0
+        return len(self.index.external) == 0
     def isCyclic(self):
         """Check if the TokenSet contains any cycles"""
-        return len(self.getCyclicDependencyGraph()[0]) > 0
+        return len(self.index.order) != len(self.index.names)
     def isIterated(self):
         """Check if the TokenSet contains any iterated tokens"""
         for t in self.names:
             if self[t].iterated is True: return True
         return False
-    def singularize(self):
-        """Generate a list of TokenSets each with only a single value per token"""
+    def iterSingularize(self):
+        """Generate TokenSets each with only a single value per token, one combination at a time"""
         # Check the TokenSet is valid:
         if self.complete is not True: raise MissingTokenError(self.getExternalDependencies())
-        if self.cyclic is True: raise CyclicTokenDependencyError(set(ts.getCyclicDependencyGraph()[0].keys()))
-        # Expand the token set to produce a list of non-iterated TokenSets:
+        if self.cyclic is True: raise CyclicTokenDependencyError(set(self.getCyclicDependencyGraph()[0].keys()))
+        # Expand the token set to yield non-iterated TokenSets:
         names = self.names
         values = [self[i].values for i in names]
-        output = []
-        for i in list(product(*values)):
+        for i in product(*values):
             new_tokenset = TokenSet()
             for j in range(len(names)):
-                new_tokenset.add(Token(names[j], i[j]))
-            output.append(new_tokenset)
-        return(output)
-    def resolve(self):
-        """Generate a list of non-iterated TokenSets with all dependencies resolved to their values"""
+                new_tokenset.add(Token(names[j], [i[j]]))
+            yield new_tokenset
+    def singularize(self):
+        """Generate a list of TokenSets each with only a single value per token"""
+        return list(self.iterSingularize())
+    def iterResolveValues(self):
+        """Generate dictionaries mapping each token name to its resolved value, one combination at a time"""
         # Check the TokenSet is valid:
         if self.complete is not True: raise MissingTokenError(self.getExternalDependencies())
-        if self.cyclic is True: raise CyclicTokenDependencyError(set(self.getCyclicDependencyGraph()[0].keys()))
-        output = []
-        for tokenset in self.singularize():
-            while True:
-                dependent_tokens = tokenset.getDependentTokens()
-                if len(dependent_tokens) == 0: break
-                for dependent_token in dependent_tokens:
-                    unresolved_value = str(list(self[dependent_token].values)[0])
-                    resolved_value = self.formatter.format(unresolved_value, tokenset.asDict())
-                    tokenset[dependent_token].values = [resolved_value]
-            output.append(tokenset)
-        return output
+        # Compile every token value against the token slots:
+        names = self.names
+        index = {t:i for i, t in enumerate(names)}
+        order = [index[t] for t in self.getResolutionOrder()]
+        values = [[v if type(v) is str else v.compile(index) for v in self[t].values] for t in names]
+        if min([len(v) for v in values], default=1) == 0: return
+        # Flag the iterated tokens each token (transitively) depends on.
+        # NB: In dependency order, the flags of the direct dependencies already cover the indirect ones:
+        iterated = [i for i in range(len(names)) if len(values[i]) > 1]
+        flags = {i:1 << n for n, i in enumerate(iterated)}
+        masks = [flags.get(i, 0) for i in range(len(names))]
+        for i in order:
+            for d in self.index.graph[names[i]]: masks[i] |= masks[index[d]]
+        # Resolve the tokens that do not vary between combinations once:
+        resolved = [None] * len(names)
+        selected = [v[0] for v in values]
+        def substitute(value):
+            if type(value) is str: return value
+            return value.substitute(resolved)
+        for i in order:
+            if masks[i] == 0: resolved[i] = substitute(selected[i])
+        # Only re-resolve the tokens affected by the iterated tokens that change between combinations:
+        affected = {}
+        previous = [None] * len(iterated)
+        for combination in product(*[range(len(values[i])) for i in iterated]):
+            changed = 0
+            for n, j in enumerate(combination):
+                if previous[n] != j:
+                    changed |= 1 << n
+                    selected[iterated[n]] = values[iterated[n]][j]
+            previous = combination
+            if changed not in affected: affected[changed] = [i for i in order if masks[i] & changed]
+            for i in affected[changed]: resolved[i] = substitute(selected[i])
+            yield dict(zip(names, resolved))
+    def iterResolve(self):
+        """Generate non-iterated TokenSets with all dependencies resolved to their values, one combination at a time"""
+        for resolved in self.iterResolveValues():
+            new_tokenset = TokenSet()
+            for t in resolved:
+                new_token = Token(t)
+                new_token.add(resolved[t], literal=True)
+                new_tokenset.add(new_token)
+            yield new_tokenset
+    def resolve(self):
+        """Generate a list of non-iterated TokenSets with all dependencies resolved to their values"""
+        return list(self.iterResolve())
+    def iterResolveToken(self, name):
+        """Attempt to resolve the value of a single token, yielding one value per combination"""
+        for resolved in self.getSubgraph(name).iterResolveValues():
+            yield resolved[name]
     def resolveToken(self, name):
         """Attempt to resolve the value of a single token, even if the rest of the TokenSet has unmet dependencies"""
-        res = self.getSubgraph(name).resolve()
-        output = [i.asDict()[name] for i in res]
-        return(output)
-    def resolveString(self, string):
-        """Attempt to resolve an arbitrary string using the TokenSet"""
-        # Find a mangled name that is not already in the token set:
+        return list(self.iterResolveToken(name))
+    def getStringDependencies(self, string):
+        """Get the entire dependency set (recursively) for an arbitrary string.
+        NB: tokens in the TokenSet are returned in definition order, followed by any external dependencies"""
+        output = set()
+        pending = list(self.formatter.extractTokens(string))
+        while len(pending) > 0:
+            t = pending.pop()
+            if t in output: continue
+            output.add(t)
+            if t in self._tokens: pending.extend(self._tokens[t].dependencies)
+        internal = sorted([t for t in output if t in self._tokens], key=self._positions.get)
+        return internal + sorted([t for t in output if t not in self._tokens])
+    def iterResolveString(self, string):
+        """Attempt to resolve an arbitrary string using the TokenSet, yielding one string per combination"""
+        # Strings without placeholders (or escaped braces) resolve to themselves:
+        if ('{' not in string) and ('}' not in string):
+            yield string
+            return
+        # Extract the subgraph the string depends on:
         ts = TokenSet()
-        for t in self.formatter.extractTokens(string): ts.extend(self.getSubgraph(t))
+        for t in self.getStringDependencies(string):
+            if t in self._tokens: ts.add(self._tokens[t])
+        # Find a mangled name that is not already in the token set:
         n = '_STR_'
-        while n in ts.names: n = '_{}'.format(n)
+        while n in ts.tokens: n = '_{}'.format(n)
         ts.add(Token(n, [string]))
-        try: res = ts.resolveToken(n)
+        try:
+            for resolved in ts.iterResolveToken(n): yield resolved
         except CyclicTokenDependencyError as err:
             err.tokens -= set([n])
             raise err
-        return res
+    def iterResolveStringTokens(self, string):
+        """Resolve the tokens an arbitrary string depends on, yielding a dictionary of token values per combination.
+        NB: The combinations are generated in the same order as iterResolveString"""
+        dependencies = self.getStringDependencies(string)
+        missing = set([t for t in dependencies if t not in self._tokens])
+        if len(missing) > 0: raise MissingTokenError(missing)
+        ts = TokenSet()
+        for t in dependencies: ts.add(self._tokens[t])
+        for resolved in ts.iterResolveValues(): yield resolved
+    def countStringCombinations(self, string):
+        """Return the number of combinations iterResolveString would yield for an arbitrary string, without resolving them"""
+        if ('{' not in string) and ('}' not in string): return 1
+        dependencies = [t for t in self.getStringDependencies(string) if t in self._tokens]
+        return prod([len(self._tokens[t]) for t in dependencies])
+    def resolveString(self, string):
+        """Attempt to resolve an arbitrary string using the TokenSet.
+        NB: results are memoized until a token the string depends on changes"""
+        if ('{' not in string) and ('}' not in string): return [string]
+        if string in self._resolved:
+            dependencies, stamps, output = self._resolved[string]
+            if stamps == tuple([self._stamps.get(t, 0) for t in dependencies]): return list(output)
+        output = list(self.iterResolveString(string))
+        dependencies = self.getStringDependencies(string)
+        self._resolved[string] = (dependencies, tuple([self._stamps.get(t, 0) for t in dependencies]), output)
+        return list(output)
     def asTFF(self):
         """Return a TFF representation of the TokenSet"""
         output = []
@@ -358,12 +701,25 @@ class TokenSet(object):
         output.append('}')
         return '\n'.join(output)
     def __getitem__(self, name): return self._tokens[name]
-    def __delitem__(self, name): del(self.tokens[name])
+    def __delitem__(self, name):
+        self._tokens[name]._owners.discard(self)
+        del(self.tokens[name])
+        del(self._positions[name])
+        self.invalidate(name)
     def __iter__(self): return iter(self.tokens)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for token in self._tokens.values(): token._owners.add(self)
     def __repr__(self): return('TokenSet({})'.format(', '.join([repr(self[t]) for t in self.names])))
     formatter = property(getFormatter, setFormatter, "Formatter used for parsing tokens")
     tokens = property(getTokens, setTokens, "The tokens held in the TokenSet")
     names = property(getNames, None, "The token names held in the TokenSet")
+    version = property(getVersion, None, "The TokenSet version (incremented on every change)")
+    index = property(getIndex, None, "The dependency index for the current TokenSet version")
     dependencies = property(getExternalDependencies, None, "The external token dependencies")
     complete = property(isComplete, None, "Does the TokenSet have any external dependencies?")
     cyclic = property(isCyclic, None, "Does the TokenSet have any internal cyclic dependencies?")
@@ -371,12 +727,89 @@ class TokenSet(object):
     tff = property(asTFF, None, "TFF representation of the TokenSet")
     json = property(asJSON, None, "JSON representation of the TokenSet")
 
+class TFFCache(object):
+    """This class encapsulates an on-disk cache of parsed TFF files"""
+    format_version = 4
+    @classmethod
+    def defaultPath(cls):
+        """Return the default cache directory"""
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base, 'qsubsec', 'tff')
+    @classmethod
+    def fileState(cls, filename):
+        """Return the modification time, size and content hash of a file"""
+        stat = os.stat(filename)
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as file_handle:
+            for block in iter(lambda: file_handle.read(1 << 20), b''): digest.update(block)
+        return (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    def __init__(self, path=None):
+        super(TFFCache, self).__init__()
+        if path is None: path = self.defaultPath()
+        self.path = path
+    def getPath(self): return self._path
+    def setPath(self, path): self._path = path
+    def getFilename(self, filename, parser):
+        """Return the cache file used for a TFF file parsed by a given parser"""
+        # NB: relative FILE() and IMPORT() paths depend on the working directory, so it forms part of the key:
+        key = hashlib.sha256()
+        for part in [str(self.format_version), type(parser).__name__, parser.encoding, os.getcwd(), os.path.abspath(filename), self.fileState(filename)[2]]:
+            key.update(part.encode('UTF-8'))
+            key.update(b'\0')
+        return os.path.join(self.path, '{}.pickle'.format(key.hexdigest()))
+    def isValid(self, sources):
+        """Check that none of the files a cached TokenSet was built from have changed"""
+        for source, state in sources.items():
+            try: current = os.stat(source)
+            except OSError: return False
+            if (current.st_mtime_ns, current.st_size) == state[:2]: continue
+            # The file was touched, but its content may not have changed:
+            if self.fileState(source)[2] != state[2]: return False
+        return True
+    def load(self, filename, parser):
+        """Return the cached TokenSet for a TFF file, or None if there is no valid cached version"""
+        try:
+            cache_filename = self.getFilename(filename, parser)
+            with open(cache_filename, 'rb') as cache_file: record = pickle.load(cache_file)
+        except FileNotFoundError: return None
+        except Exception as err:
+            log.warning('failed to read TFF cache for "{}" ({})'.format(filename, err))
+            return None
+        if self.isValid(record['sources']) is not True:
+            log.info('cached TFF data for "{}" is out of date'.format(filename))
+            return None
+        return record['tokens']
+    def store(self, filename, parser, token_set, sources):
+        """Store the TokenSet parsed from a TFF file, along with the state of every file it was built from"""
+        try:
+            cache_filename = self.getFilename(filename, parser)
+            os.makedirs(self.path, exist_ok=True)
+            handle, temp_filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as cache_file: pickle.dump({'sources':sources, 'tokens':token_set}, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filename, cache_filename)
+            log.info('cached TFF data for "{}" in "{}"'.format(filename, cache_filename))
+        except Exception as err: log.warning('failed to write TFF cache for "{}" ({})'.format(filename, err))
+    def clear(self):
+        """Remove all cached TFF data, returning the number of files removed"""
+        removed = 0
+        try: cache_files = os.listdir(self.path)
+        except FileNotFoundError: return removed
+        for cache_file in cache_files:
+            if not (cache_file.endswith('.pickle') or cache_file.endswith('.tmp')): continue
+            try:
+                os.remove(os.path.join(self.path, cache_file))
+                removed += 1
+            except FileNotFoundError: pass
+        return removed
+    path = property(getPath, setPath, "The cache directory")
+
 class TFFParser(object):
     """This class encapsulates a parser for TFF files"""
-    def __init__(self, recursionLimit=getrecursionlimit(), encoding='UTF-8'):
-        super(TFFParser, self).__init__()
-        self.recursionLimit = recursionLimit
-        self.encoding = encoding
+    _grammar = None
+    @classmethod
+    def getGrammar(cls):
+        """Return the TFF DSL parser object, building it the first time it is needed"""
+        if TFFParser._grammar is not None: return TFFParser._grammar
         # Define the TFF DSL:
         kw_chars = alphanums + '.' + '-' + '_' + '{' + '}' + '/' + ':'
         fn_chars = alphanums + '.' + '-' + '_' + '{' + '}' + '/' + ':'
@@ -396,24 +829,98 @@ class TFFParser(object):
         function_assignment = Group(name.setResultsName('token') + equals + function_field).setResultsName('func_assignment')
         mod_statement = Group(mod_keyword.setResultsName('func') + open_parenthesis + fname.setResultsName('argument') + close_parenthesis).setResultsName('mod')
         statement = assignment ^ function_assignment ^ mod_statement + Optional(comment) ^ Suppress(LineEnd())
-        self._parser = ZeroOrMore(empty_line ^ statement)
-    def getParser(self): return self._parser
+        TFFParser._grammar = ZeroOrMore(empty_line ^ statement)
+        return TFFParser._grammar
+    def __init__(self, recursionLimit=getrecursionlimit(), encoding='UTF-8', cache=None, fetcher=None):
+        super(TFFParser, self).__init__()
+        self.recursionLimit = recursionLimit
+        self.encoding = encoding
+        self.cache = cache
+        self.fetcher = fetcher
+        self._sources = None
+        self._imported = None
+        self._importing = None
+    def getParser(self): return self.getGrammar()
+    def statements(self, input_string):
+        """Split a TFF string into statements.
+        Each statement is a tuple of the statement type ('assignment', 'func_assignment' or 'mod') and its fields"""
+        try: parsed = self.parser.parseString(input_string, parseAll=True)
+        except ParseException as err: raise TFFSyntaxError(err.lineno, err.line.strip())
+        for s in parsed:
+            if s.getName() == 'assignment': yield ('assignment', s.token, list(s.token_values))
+            elif s.getName() == 'func_assignment': yield ('func_assignment', s.token, s.func.upper(), s.argument)
+            else: yield ('mod', s.func.upper(), s.argument)
     def getRecursionLimit(self): return self._recursion_limit
     def setRecursionLimit(self, limit): self._recursion_limit = limit
     def getEncoding(self): return self._encoding
     def setEncoding(self, encoding): self._encoding = encoding
+    def getCache(self): return self._cache
+    def setCache(self, cache): self._cache = cache
+    def getFetcher(self):
+        if self._fetcher is None: return getDefaultFetcher()
+        return self._fetcher
+    def setFetcher(self, fetcher): self._fetcher = fetcher
+    def addSource(self, source, cacheable=True):
+        """Record a file (or URL) read while parsing, so that cached results can be validated"""
+        if self._sources is None: return
+        if cacheable is True:
+            try:
+                path = os.path.abspath(source)
+                if path not in self._sources: self._sources[path] = TFFCache.fileState(path)
+                return
+            except OSError: pass
+        self._cacheable = False
+    def startSession(self):
+        """Start a parse session (returning False if one is already in progress).
+        Within a session each imported file is only parsed once"""
+        if self._imported is not None: return False
+        self._imported = OrderedDict()
+        self._importing = []
+        return True
+    def endSession(self):
+        """End the current parse session"""
+        self._imported = None
+        self._importing = None
     def parse(self, filename, depth=0):
         """Parse a TFF file to yield a TokenSet"""
         if hasattr(filename, 'read'):
             # filename looks like a file handle (i.e. it has a read method):
             log.info('extracting TFF string from file handle "{}"'.format(filename.name))
             input_string = filename.read()
-        else:
-            # filename does not look like a file handle:
-            log.info('extracting TFF string from file "{}"'.format(filename))
-            with open(filename, 'rt') as input_file:
-                input_string = input_file.read()
-        return self.parseString(input_string, depth=depth)
+            return self.parseString(input_string, depth=depth)
+        if (depth == 0) and (self.cache is not None) and (self._sources is None):
+            return self.parseCached(filename)
+        if self.startSession() is True:
+            try: return self.parse(filename, depth=depth)
+            finally: self.endSession()
+        # filename does not look like a file handle:
+        path = os.path.realpath(filename)
+        if path in self._importing: raise TFFImportCycleError(self._importing[self._importing.index(path):] + [path])
+        if path in self._imported:
+            log.info('reusing parsed TFF file "{}"'.format(filename))
+            return self._imported[path]
+        if depth > self.recursionLimit: raise TFFRecursionError(self.recursionLimit, filename)
+        log.info('extracting TFF string from file "{}"'.format(filename))
+        self.addSource(filename)
+        with open(filename, 'rt') as input_file:
+            input_string = input_file.read()
+        self._importing.append(path)
+        try: output_ts = self.parseString(input_string, depth=depth)
+        finally: self._importing.pop()
+        self._imported[path] = output_ts
+        return output_ts
+    def parseCached(self, filename):
+        """Parse a TFF file, using the cached TokenSet if none of the files involved have changed"""
+        output_ts = self.cache.load(filename, self)
+        if output_ts is not None:
+            log.info('using cached TFF data for file "{}"'.format(filename))
+            return output_ts
+        self._sources = OrderedDict()
+        self._cacheable = True
+        try: output_ts = self.parse(filename)
+        finally: sources, self._sources = self._sources, None
+        if self._cacheable is True: self.cache.store(filename, self, output_ts, sources)
+        return output_ts
     def parseHandle(self, file_handle, depth=0):
         """Parse a TFF file to yield a TokenSet"""
         log.info('extracting TFF string from file handle')
@@ -422,55 +929,122 @@ class TFFParser(object):
     def parseURL(self, url, depth=0):
         """Parse a TFF URL to yield a TokenSet"""
         log.info('extracting TFF string from URL using encoding "{}"'.format(self.encoding))
-        with urlopen(url) as input_url:
-            input_string = input_url.read().decode(self.encoding)
+        input_string = self.fetcher.fetchText(url, self.encoding)
         return self.parseString(input_string, depth=depth)
     def parseString(self, input_string, depth=0):
         """Parse a TFF string to yield a TokenSet"""
+        if self.startSession() is True:
+            try: return self.parseString(input_string, depth=depth)
+            finally: self.endSession()
         log.info('parsing TFF string')    
         log.debug('TFF string:\n{}'.format(input_string))
         output_ts = TokenSet()
-        # Open and parse the file:
-        file_data = self.parser.parseString(input_string, parseAll=True)
         # Update the output token set:
-        for s in file_data:
-            if s.getName() is 'assignment':
-                for resolved_name in output_ts.resolveString(s.token):
-                    new_token = Token(resolved_name, s.token_values)
+        for s in self.statements(input_string):
+            if s[0] == 'assignment':
+                for resolved_name in output_ts.resolveString(s[1]):
+                    new_token = Token(resolved_name, s[2])
                     log.debug('assigning token  {}'.format(new_token.asText()))
                     output_ts.add(new_token)
-            elif s.getName() is 'func_assignment':
-                if s.func is 'FILE':
-                    for resolved_filename in output_ts.resolveString(s.argument):
+            elif s[0] == 'func_assignment':
+                token, func, argument = s[1:]
+                if func == 'FILE':
+                    for resolved_filename in output_ts.resolveString(argument):
                         log.info('reading data from file "{}"'.format(resolved_filename))
-                        output_ts.add(Token.fromFile(s.token, resolved_filename, simple=False))
-                elif s.func is 'SFILE':
-                    for resolved_filename in output_ts.resolveString(s.argument):
+                        self.addSource(resolved_filename)
+                        output_ts.add(Token.fromFile(token, resolved_filename, simple=False))
+                elif func == 'SFILE':
+                    for resolved_filename in output_ts.resolveString(argument):
                         log.info('reading simple data from file "{}"'.format(resolved_filename))
-                        output_ts.add(Token.fromFile(s.token, resolved_filename, simple=True))
-                elif s.func is 'URL':
-                    for resolved_url in output_ts.resolveString(s.argument):
+                        self.addSource(resolved_filename)
+                        output_ts.add(Token.fromFile(token, resolved_filename, simple=True))
+                elif func == 'URL':
+                    resolved_urls = list(output_ts.resolveString(argument))
+                    self.fetcher.prefetch(resolved_urls)
+                    for resolved_url in resolved_urls:
                         log.info('reading data from from URL "{}"'.format(resolved_url))
-                        output_ts.add(Token.fromURL(s.token, resolved_url, simple=False))
-                elif s.func is 'SURL':
-                    for resolved_url in output_ts.resolveString(s.argument):
+                        self.addSource(resolved_url, cacheable=False)
+                        output_ts.add(Token.fromURL(token, resolved_url, simple=False, fetcher=self.fetcher))
+                elif func == 'SURL':
+                    resolved_urls = list(output_ts.resolveString(argument))
+                    self.fetcher.prefetch(resolved_urls)
+                    for resolved_url in resolved_urls:
                         log.info('reading simple data from from URL "{}"'.format(resolved_url))
-                        output_ts.add(Token.fromURL(s.token, resolved_url, simple=True, encoding=self.encoding))
-                else: raise NotImplementedError('Assignment from function {} not implemented yet'.format(s.func))
-            elif s.getName() is 'mod':
-                if s.func is 'IMPORT':
-                    for resolved_filename in output_ts.resolveString(s.argument):
+                        self.addSource(resolved_url, cacheable=False)
+                        output_ts.add(Token.fromURL(token, resolved_url, simple=True, encoding=self.encoding, fetcher=self.fetcher))
+                else: raise NotImplementedError('Assignment from function {} not implemented yet'.format(func))
+            elif s[0] == 'mod':
+                func, argument = s[1:]
+                if func == 'IMPORT':
+                    for resolved_filename in output_ts.resolveString(argument):
                         log.info('including TFF file "{}"'.format(resolved_filename))
                         new_data = self.parse(resolved_filename, depth=depth + 1)
                         output_ts.extend(new_data)
-                elif s.func is 'REMOVE':
-                    for resolved_name in output_ts.resolveString(s.argument):
+                elif func == 'REMOVE':
+                    for resolved_name in output_ts.resolveString(argument):
                         if resolved_name in output_ts:
                             log.debug('removing token {}'.format(output_ts[resolved_name].asText()))
                             del output_ts[resolved_name]
                         else: log.info('removing token "{}" failed: token not present'.format(resolved_name))
-            else: raise NotImplementedError('Modifier function {} not implemented'.format(s.func))
+                else: raise NotImplementedError('Modifier function {} not implemented'.format(func))
         return output_ts
     recursionLimit = property(getRecursionLimit, setRecursionLimit, "The maximum permissibe recursion limit")
     encoding = property(getEncoding, setEncoding, "The encoding to use when reading data from URL")
+    cache = property(getCache, setCache, "The TFFCache used for TFF files (or None)")
+    fetcher = property(getFetcher, setFetcher, "The URLFetcher used to read data from URLs")
     parser = property(getParser, None, "The TFF DSL parser object")
+
+class TFFLineParser(TFFParser):
+    """This class encapsulates a line-oriented parser for TFF files that does not use pyparsing"""
+    _element_re = re.compile(r'''\s*(?:(?P<word>[A-Za-z0-9.\-_{}/:]+)|"(?P<dquote>[^"\n]*)"|'(?P<squote>[^'\n]*)'|(?P<op>[=(),])|(?P<comment>#.*))''')
+    _function_keywords = set(['FILE', 'SFILE', 'URL', 'SURL'])
+    _mod_keywords = set(['IMPORT', 'REMOVE'])
+    # NB: As with pyparsing quoted strings, whitespace escapes in quoted names and values are converted:
+    _escape_re = re.compile(r'\\[tnfr]')
+    _escapes = {'\\t':'\t', '\\n':'\n', '\\f':'\f', '\\r':'\r'}
+    def getParser(self): return None
+    def unescape(self, text):
+        """Convert the whitespace escapes in a quoted string"""
+        if '\\' not in text: return text
+        return self._escape_re.sub(lambda m: self._escapes[m.group()], text)
+    def lex(self, line):
+        """Split a single TFF line into (kind, text) elements, dropping any comment"""
+        output = []
+        position = 0
+        end = len(line.rstrip())
+        while position < end:
+            match = self._element_re.match(line, position)
+            if match is None: return None
+            position = match.end()
+            kind = match.lastgroup
+            if kind == 'comment': break
+            if kind == 'op': output.append((match.group(kind), None))
+            elif kind == 'word': output.append(('value', match.group(kind)))
+            else: output.append(('quoted', self.unescape(match.group(kind))))
+        return output
+    def statements(self, input_string):
+        """Split a TFF string into statements.
+        Each statement is a tuple of the statement type ('assignment', 'func_assignment' or 'mod') and its fields"""
+        for line_number, line in enumerate(input_string.splitlines(), start=1):
+            elements = self.lex(line)
+            if elements is None: raise TFFSyntaxError(line_number, line.strip())
+            if len(elements) == 0: continue
+            kinds = [e[0] for e in elements]
+            # NAME = FUNC(ARGUMENT):
+            if (kinds[1:3] == ['=', 'value']) and (kinds[3:4] == ['(']) and (kinds[0] in ('value', 'quoted')) and (elements[2][1].upper() in self._function_keywords):
+                if (len(elements) == 6) and (kinds[4] in ('value', 'quoted')) and (kinds[5] == ')'):
+                    yield ('func_assignment', elements[0][1], elements[2][1].upper(), elements[4][1])
+                    continue
+            # FUNC(ARGUMENT):
+            elif (kinds[0:2] == ['value', '(']) and (elements[0][1].upper() in self._mod_keywords):
+                if (len(elements) == 4) and (kinds[2] in ('value', 'quoted')) and (kinds[3] == ')'):
+                    yield ('mod', elements[0][1].upper(), elements[2][1])
+                    continue
+            # NAME = VALUE[, VALUE...]:
+            elif (len(elements) >= 3) and (kinds[0] in ('value', 'quoted')) and (kinds[1] == '='):
+                values = elements[2::2]
+                separators = elements[3::2]
+                if all([v[0] in ('value', 'quoted') for v in values]) and all([d[0] == ',' for d in separators]) and (len(values) == len(separators) + 1):
+                    yield ('assignment', elements[0][1], [v[1] for v in values])
+                    continue
+            raise TFFSyntaxError(line_number, line.strip())
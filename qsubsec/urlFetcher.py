@@ -0,0 +1,193 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import urlsplit, urljoin
+from urllib.request import urlopen, getproxies, proxy_bypass
+from urllib.error import HTTPError, URLError
+import http.client
+import hashlib
+import os
+import pickle
+import tempfile
+import logging as log
+
+class URLFetcher(object):
+    """This class encapsulates a shared URL fetcher.
+    HTTP(S) connections are kept alive and reused for each host, responses can be cached on disk (and revalidated using
+    their ETag and Last-Modified headers), and sets of URLs can be prefetched concurrently. Fetched data is kept in memory
+    for the lifetime of the fetcher"""
+    redirect_codes = set([301, 302, 303, 307, 308])
+    max_redirects = 10
+    @classmethod
+    def defaultCachePath(cls):
+        """Return the default cache directory"""
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base, 'qsubsec', 'http')
+    def __init__(self, cache_path=None, jobs=8, timeout=60):
+        super(URLFetcher, self).__init__()
+        self.cache_path = cache_path
+        self.jobs = jobs
+        self.timeout = timeout
+        self._lock = Lock()
+        self._connections = {}
+        self._fetched = OrderedDict()
+    def __getstate__(self):
+        return {'cache_path':self.cache_path, 'jobs':self.jobs, 'timeout':self.timeout}
+    def __setstate__(self, state):
+        self.__init__(**state)
+    def getCachePath(self): return self._cache_path
+    def setCachePath(self, cache_path): self._cache_path = cache_path
+    def getJobs(self): return self._jobs
+    def setJobs(self, jobs): self._jobs = max(int(jobs), 1)
+    def getTimeout(self): return self._timeout
+    def setTimeout(self, timeout): self._timeout = timeout
+    def getConnection(self, scheme, netloc):
+        """Return an idle connection to a host (and whether it has been used before), opening a new one if necessary"""
+        with self._lock:
+            idle = self._connections.get((scheme, netloc), [])
+            if len(idle) > 0: return idle.pop(), True
+        if scheme == 'https': return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+    def releaseConnection(self, scheme, netloc, connection):
+        """Return a connection to the idle pool for its host"""
+        with self._lock: self._connections.setdefault((scheme, netloc), []).append(connection)
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            for idle in self._connections.values():
+                for connection in idle: connection.close()
+            self._connections = {}
+    def clear(self):
+        """Forget all data fetched by this fetcher"""
+        with self._lock: self._fetched = OrderedDict()
+    def getCacheFilename(self, url):
+        return os.path.join(self.cache_path, '{}.pickle'.format(hashlib.sha256(url.encode('UTF-8')).hexdigest()))
+    def loadCached(self, url):
+        """Return the cached response record for a URL (or None)"""
+        if self.cache_path is None: return None
+        try:
+            with open(self.getCacheFilename(url), 'rb') as cache_file: record = pickle.load(cache_file)
+        except FileNotFoundError: return None
+        except Exception as err:
+            log.warning('failed to read HTTP cache for "{}" ({})'.format(url, err))
+            return None
+        if record.get('url') != url: return None
+        return record
+    def storeCached(self, url, headers, data):
+        """Cache a response if it has a validator that can be used to revalidate it later"""
+        if self.cache_path is None: return
+        if 'no-store' in headers.get('Cache-Control', ''): return
+        record = {'url':url, 'etag':headers.get('ETag'), 'last_modified':headers.get('Last-Modified'), 'data':data}
+        if (record['etag'] is None) and (record['last_modified'] is None): return
+        try:
+            os.makedirs(self.cache_path, exist_ok=True)
+            handle, temp_filename = tempfile.mkstemp(dir=self.cache_path, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as cache_file: pickle.dump(record, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filename, self.getCacheFilename(url))
+        except Exception as err: log.warning('failed to write HTTP cache for "{}" ({})'.format(url, err))
+    def clearCache(self):
+        """Remove all cached HTTP responses, returning the number of files removed"""
+        removed = 0
+        if self.cache_path is None: return removed
+        try: cache_files = os.listdir(self.cache_path)
+        except FileNotFoundError: return removed
+        for cache_file in cache_files:
+            if not (cache_file.endswith('.pickle') or cache_file.endswith('.tmp')): continue
+            try:
+                os.remove(os.path.join(self.cache_path, cache_file))
+                removed += 1
+            except FileNotFoundError: pass
+        return removed
+    def request(self, url, headers):
+        """Make a single GET request using a pooled connection, returning the response and its body"""
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query != '': path = '{}?{}'.format(path, parts.query)
+        while True:
+            connection, reused = self.getConnection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                # A reused connection may have been closed by the server while idle, so retry once with a new connection:
+                if reused is True: continue
+                raise
+            if response.will_close: connection.close()
+            else: self.releaseConnection(parts.scheme, parts.netloc, connection)
+            return response, data
+    def download(self, url):
+        """Download the content of a URL, revalidating any cached copy"""
+        parts = urlsplit(url)
+        if (parts.scheme not in ('http', 'https')) or (parts.scheme in getproxies() and not proxy_bypass(parts.hostname or '')):
+            # Fall back to urllib for other schemes and proxied requests:
+            with urlopen(url, timeout=self.timeout) as url_handle: return url_handle.read()
+        cached = self.loadCached(url)
+        headers = {'User-Agent':'qsubsec', 'Accept-Encoding':'identity'}
+        if cached is not None:
+            if cached['etag'] is not None: headers['If-None-Match'] = cached['etag']
+            if cached['last_modified'] is not None: headers['If-Modified-Since'] = cached['last_modified']
+        request_url = url
+        for redirect in range(self.max_redirects + 1):
+            response, data = self.request(request_url, headers)
+            if (response.status in self.redirect_codes) and (response.getheader('Location') is not None):
+                request_url = urljoin(request_url, response.getheader('Location'))
+                log.debug('following redirect to "{}"'.format(request_url))
+                continue
+            break
+        else: raise URLError('too many redirects fetching "{}"'.format(url))
+        if (response.status == 304) and (cached is not None):
+            log.info('using cached HTTP response for "{}"'.format(url))
+            return cached['data']
+        if response.status >= 400: raise HTTPError(url, response.status, response.reason, response.headers, None)
+        self.storeCached(url, response.headers, data)
+        return data
+    def fetch(self, url):
+        """Return the content of a URL as bytes"""
+        with self._lock:
+            if url in self._fetched: return self._fetched[url]
+        log.info('fetching URL "{}"'.format(url))
+        data = self.download(url)
+        with self._lock: self._fetched[url] = data
+        return data
+    def fetchText(self, url, encoding='UTF-8'):
+        """Return the content of a URL as a string"""
+        return self.fetch(url).decode(encoding)
+    def prefetch(self, urls):
+        """Fetch a set of URLs concurrently. Errors are ignored here, and will be raised when the URL is fetched again"""
+        with self._lock: urls = [url for url in OrderedDict.fromkeys(urls) if url not in self._fetched]
+        if len(urls) < 2: return
+        log.info('prefetching {} URLs'.format(len(urls)))
+        def prefetchURL(url):
+            try: self.fetch(url)
+            except Exception as err: log.debug('prefetching "{}" failed ({})'.format(url, err))
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(urls))) as pool: list(pool.map(prefetchURL, urls))
+    cache_path = property(getCachePath, setCachePath, "The HTTP cache directory (or None to disable caching)")
+    jobs = property(getJobs, setJobs, "The maximum number of URLs to prefetch concurrently")
+    timeout = property(getTimeout, setTimeout, "The connection timeout in seconds")
+
+# The shared fetcher used when none is given:
+_default_fetcher = URLFetcher()
+
+def getDefaultFetcher():
+    """Return the shared URLFetcher"""
+    return _default_fetcher
+
+def setDefaultFetcher(fetcher):
+    """Set the shared URLFetcher"""
+    global _default_fetcher
+    _default_fetcher = fetcher
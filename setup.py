@@ -23,7 +23,7 @@ setup(
     install_requires = [
         'pyparsing>=2.2.0'
     ],
-    python_requires = '>=3',
+    python_requires = '>=3.9',
     entry_points = {
         'console_scripts': [
             'qsubsec=qsubsec.scripts:qsmain',
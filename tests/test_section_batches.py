@@ -0,0 +1,111 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of grouping sections into task arrays"""
+
+import logging
+import unittest
+from fnmatch import fnmatchcase
+from qsubsec.tokens import TFFLineParser
+from qsubsec.templates import Template
+from qsubsec.sectionFormatter import QSUBFormatter, LSFFormatter, SlurmFormatter, PBSFormatter
+from qsubsec.scripts import iterSectionProgress, iterSectionBatches
+
+# A pipeline in which each report holds on every alignment (including those for later samples):
+pipeline_template = """
+section('PREP_{S}', description='prepare {S}')
+outputs('/tmp', validate=False)
+command('prepare {S}')
+section('ALIGN_{S}', description='align {S}')
+outputs('/tmp', validate=False)
+hold('PREP_{S}')
+command('align {S}')
+section('REPORT_{S}', description='report {S}')
+outputs('/tmp', validate=False)
+hold('ALIGN_*')
+command('report {S}')
+"""
+
+class SectionBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.positions = {}
+    def batches(self, template, tokens, formatter, batch_size):
+        """Return the (name, section names) batches for a template"""
+        template = Template(string=template)
+        token_set = TFFLineParser().parseString(tokens)
+        sections = iterSectionProgress(template.iterExecute(token_set), template.getCombinations(token_set))
+        batches = iterSectionBatches(logging.getLogger(), sections, formatter, batch_size)
+        output = []
+        for name, items in batches:
+            # Record the position of each section in the template output:
+            for i, total, section in items: self.positions[id(section)] = i
+            output.append((name, [section for i, total, section in items]))
+        return output
+    def assertHoldsOnEarlierBatches(self, batches):
+        """Check that every earlier section matching a hold (by section or task array name) is submitted in an earlier batch"""
+        order = [(j, section) for j, (name, sections) in enumerate(batches) for section in sections]
+        order.sort(key=lambda x: self.positions[id(x[1])])
+        for k, (i, section) in enumerate(order):
+            for hold in section.holds:
+                for j, other in order[:k]:
+                    if fnmatchcase(other.name, hold) or fnmatchcase(batches[j][0], hold):
+                        self.assertLess(j, i, 'section {} in batch {} holds on section {} in batch {} ({})'.format(section.name, batches[i][0], other.name, batches[j][0], hold))
+    def testHoldOrder(self):
+        batches = self.batches(pipeline_template, 'S = a, b, c', QSUBFormatter, 5)
+        self.assertEqual([(name, [s.name for s in sections]) for name, sections in batches], [
+            ('PREP_a', ['PREP_a', 'PREP_b']),
+            ('ALIGN_a', ['ALIGN_a', 'ALIGN_b']),
+            ('REPORT_a', ['REPORT_a']),
+            ('REPORT_b', ['REPORT_b']),
+            ('PREP_c', ['PREP_c']),
+            ('ALIGN_c', ['ALIGN_c']),
+            ('REPORT_c', ['REPORT_c']),
+        ])
+        # Holds on batched sections are rewritten to their task arrays:
+        self.assertEqual(list(batches[1][1][1].holds), ['PREP_a'])
+        self.assertHoldsOnEarlierBatches(batches)
+    def testHoldOrderAllFormats(self):
+        for formatter in (QSUBFormatter, LSFFormatter, SlurmFormatter, PBSFormatter):
+            for batch_size in range(1, 13):
+                with self.subTest(formatter=formatter.__name__, batch_size=batch_size):
+                    batches = self.batches(pipeline_template, 'S = a, b, c, d', formatter, batch_size)
+                    self.assertEqual(sum([len(sections) for name, sections in batches]), 12)
+                    self.assertHoldsOnEarlierBatches(batches)
+    def testSelfHold(self):
+        # A section holding on an earlier section in the same open batch starts a new batch:
+        template = "section('STEP_{S}', description='step {S}')\noutputs('/tmp', validate=False)\nhold('STEP_*')\ncommand('step {S}')\n"
+        batches = self.batches(template, 'S = a, b, c', QSUBFormatter, 10)
+        self.assertEqual([name for name, sections in batches], ['STEP_a', 'STEP_b', 'STEP_c'])
+        self.assertHoldsOnEarlierBatches(batches)
+    def testWildcardHoldOnArrayMember(self):
+        # A wildcard hold matching only later sections in a task array also holds on the array:
+        template = pipeline_template.replace("hold('ALIGN_*')", "hold('ALIGN_[bc]')")
+        batches = self.batches(template, 'S = a, b, c', QSUBFormatter, 10)
+        self.assertEqual([(name, [s.name for s in sections]) for name, sections in batches], [
+            ('PREP_a', ['PREP_a', 'PREP_b', 'PREP_c']),
+            ('ALIGN_a', ['ALIGN_a', 'ALIGN_b', 'ALIGN_c']),
+            ('REPORT_a', ['REPORT_a']),
+            ('REPORT_b', ['REPORT_b', 'REPORT_c']),
+        ])
+        self.assertEqual(list(batches[2][1][0].holds), ['ALIGN_[bc]'])
+        self.assertEqual(list(batches[3][1][0].holds), ['ALIGN_[bc]', 'ALIGN_a'])
+        self.assertHoldsOnEarlierBatches(batches)
+        # Holds whose pattern matches the array name are not repeated:
+        batches = self.batches(pipeline_template, 'S = a, b, c', QSUBFormatter, 10)
+        self.assertEqual(set([tuple(s.holds) for name, sections in batches for s in sections if s.name.startswith('REPORT')]), set([('ALIGN_*',)]))
+    def testIndependentSections(self):
+        template = "section('STEP_{S}', description='step {S}')\noutputs('/tmp', validate=False)\ncommand('step {S}')\n"
+        batches = self.batches(template, 'S = a, b, c, d, e', QSUBFormatter, 2)
+        self.assertEqual([(name, [s.name for s in sections]) for name, sections in batches], [('STEP_a', ['STEP_a', 'STEP_b']), ('STEP_c', ['STEP_c', 'STEP_d']), ('STEP_e', ['STEP_e'])])
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,36 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the scheduler limit directives"""
+
+import unittest
+from qsubsec.sectionFormatter import QSUBFormatter, LSFFormatter, SlurmFormatter
+
+class RunLimitTest(unittest.TestCase):
+    def testSGE(self):
+        # SGE reads the limit itself, so it is written unchanged:
+        for value in ('3600', '1:30', '01:00:00'): self.assertEqual(QSUBFormatter.limitDirective('h_rt', value), '-l h_rt={}'.format(value))
+    def testLSF(self):
+        # LSF run limits are hours:minutes, rounded up to whole minutes:
+        for value, directive in (('3600', '-W 1:00'), ('59', '-W 0:01'), ('1:30', '-W 0:02'), ('00:01:00', '-W 0:01'), ('10:00:01', '-W 10:01'), ('0', '-W 0:00')):
+            with self.subTest(value=value): self.assertEqual(LSFFormatter.limitDirective('h_rt', value), directive)
+    def testSlurm(self):
+        for value, directive in (('3600', '--time=01:00:00'), ('1:30', '--time=00:01:30'), ('00:01:00', '--time=00:01:00'), ('100:00:00', '--time=100:00:00')):
+            with self.subTest(value=value): self.assertEqual(SlurmFormatter.limitDirective('h_rt', value), directive)
+    def testInvalid(self):
+        for formatter in (LSFFormatter, SlurmFormatter):
+            for value in ('1h', '1.5', '', '1:2:3:4', '-60'):
+                with self.subTest(formatter=formatter.__name__, value=value):
+                    with self.assertRaises(ValueError): formatter.limitDirective('h_rt', value)
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,67 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of skipping journaled sections when resuming a submission"""
+
+import logging
+import os
+import tempfile
+import unittest
+from collections import OrderedDict
+from qsubsec.tokens import TFFLineParser
+from qsubsec.templates import Template
+from qsubsec.sectionFormatter import SlurmFormatter
+from qsubsec.sectionSubmitter import SubmissionJournal
+from qsubsec.scripts import iterSectionProgress, iterJournalSections
+
+# A pipeline in which every sample's report section has the same name:
+report_template = """
+section('ALIGN_{S}', description='align {S}')
+outputs('/tmp', validate=False)
+command('align {S}')
+section('REPORT', description='report {S}')
+outputs('/tmp', validate=False)
+hold('ALIGN_{S}')
+command('report {S}')
+"""
+
+class JournalResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.journal = SubmissionJournal(os.path.join(self.directory.name, 'journal.jsonl'))
+        self.addCleanup(self.journal.close)
+    def submit(self, tokens, resume=False):
+        """Pass the template sections through the journal, recording the sections that are not skipped with sequential job IDs"""
+        template = Template(string=report_template)
+        token_set = TFFLineParser().parseString(tokens)
+        sections = iterSectionProgress(template.iterExecute(token_set), template.getCombinations(token_set))
+        hashes = {}
+        resumed = OrderedDict()
+        skipped = []
+        submitted = []
+        for i, total, section in iterJournalSections(logging.getLogger(), sections, SlurmFormatter, self.journal, hashes, resumed, skipped, resume=resume):
+            job_id = str(100 + len(self.journal.job_ids))
+            self.journal.record(section.name, hashes[id(section)], job_id)
+            submitted.append((section.name, job_id))
+        return submitted, resumed, skipped
+    def testDuplicateNames(self):
+        submitted, resumed, skipped = self.submit('S = a, b, c')
+        self.assertEqual(submitted, [('ALIGN_a', '100'), ('REPORT', '101'), ('ALIGN_b', '102'), ('REPORT', '103'), ('ALIGN_c', '104'), ('REPORT', '105')])
+        # Every skipped section is counted, and each journaled job ID is kept for sections sharing a name:
+        submitted, resumed, skipped = self.submit('S = a, b, c, d', resume=True)
+        self.assertEqual(submitted, [('ALIGN_d', '106'), ('REPORT', '107')])
+        self.assertEqual(skipped, ['ALIGN_a', 'REPORT', 'ALIGN_b', 'REPORT', 'ALIGN_c', 'REPORT'])
+        self.assertEqual(dict(resumed), {'ALIGN_a':['100'], 'REPORT':['101', '103', '105'], 'ALIGN_b':['102'], 'ALIGN_c':['104']})
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,43 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of running sections as a hold dependency graph"""
+
+import unittest
+from qsubsec.sectionSubmitter import SubmissionPool, outputSubmitterAsync
+
+class SpawnGraphTest(unittest.TestCase):
+    def runGraph(self, items):
+        """Run (name, data, holds, members) items through cat, returning the outputs each section held on and its unmatched holds"""
+        resolved = {}
+        def resolve(data, outputs, unmatched):
+            resolved[data] = (sorted(outputs), unmatched)
+            return data
+        pool = SubmissionPool(outputSubmitterAsync, ['cat'], jobs=4, check=True, resolve=resolve)
+        results = list(pool.iterSpawnGraph(items))
+        self.assertEqual([(name, output, err) for name, output, err in results], [(item[0], item[1], None) for item in items])
+        return resolved
+    def testArrayMembers(self):
+        resolved = self.runGraph([
+            ('ALIGN_a', 'ALIGN_a', [], ['ALIGN_a', 'ALIGN_b', 'ALIGN_c']),
+            ('ALIGN_d', 'ALIGN_d', [], ['ALIGN_d']),
+            ('REPORT_b', 'REPORT_b', ['ALIGN_b'], ['REPORT_b']),
+            ('REPORT_c', 'REPORT_c', ['ALIGN_[cd]'], ['REPORT_c']),
+            ('FINAL', 'FINAL', ['ALIGN_*', 'ALIGN_a', 'MISSING_*'], ['FINAL']),
+        ])
+        # Holds on any member of a task array hold on the array (once):
+        self.assertEqual(resolved['REPORT_b'], (['ALIGN_a'], []))
+        self.assertEqual(resolved['REPORT_c'], (['ALIGN_a', 'ALIGN_d'], []))
+        self.assertEqual(resolved['FINAL'], (['ALIGN_a', 'ALIGN_d'], ['MISSING_*']))
+
+if __name__ == '__main__': unittest.main()
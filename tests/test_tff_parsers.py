@@ -0,0 +1,146 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Conformance tests running the pyparsing and line-oriented TFF parsers on the same inputs"""
+
+import os
+import os.path
+import tempfile
+import unittest
+from qsubsec.tokens import TFFParser, TFFLineParser, TFFSyntaxError, TFFImportCycleError
+
+# TFF strings that both parsers must accept, giving identical TokenSets:
+valid_corpus = [
+    ('empty', ''),
+    ('blank lines', '\n\n   \n'),
+    ('simple', 'A = 1'),
+    ('no spaces', 'A=1'),
+    ('surrounding whitespace', '   A = 1   '),
+    ('iterated', 'A = 1, 2, 3'),
+    ('iterated spacing', 'A=1 ,2,  3'),
+    ('unquoted characters', 'A = a.b-c_d/e:f'),
+    ('comment line', '# a comment'),
+    ('indented comment', '   # a comment'),
+    ('trailing comment', 'A = 1 # a comment'),
+    ('trailing comment without space', 'A = 1#a comment'),
+    ('comment after iterated values', 'A = 1, 2 # a comment'),
+    ('double quotes', 'A = "a value"'),
+    ('single quotes', "A = 'a value'"),
+    ('empty quotes', 'A = ""'),
+    ('quoted hash', 'A = "a # b"'),
+    ('quoted comma', 'A = "a, b", c'),
+    ('quoted equals', 'A = "a = b"'),
+    ('quoted parentheses', 'A = "FILE(a)"'),
+    ('quoted name', '"a name" = 1'),
+    ('single quoted name', "'a name' = 1"),
+    ('nested quotes', 'A = "it\'s"\nB = \'say "hi"\''),
+    ('mixed quoting', 'A = a, "b c", \'d\''),
+    ('tab escape', r'A = "a\tb"'),
+    ('newline escape', r"A = 'a\nb'"),
+    ('form feed and return escapes', r'A = "a\fb\rc"'),
+    ('escaped backslash', r'A = "a\\b"'),
+    ('escaped tab after backslash', r'A = "a\\tb"'),
+    ('other escapes', r'A = "\x41\101\q"'),
+    ('unquoted backslash path', r"A = 'C:\temp\new'"),
+    ('placeholder value', 'A = 1\nB = "{A}"'),
+    ('placeholder name', 'A = x, y\nB_{A} = {A}'),
+    ('redefinition', 'A = 1\nA = 2'),
+    ('remove', 'A = 1\nB = 2\nREMOVE(A)'),
+    ('remove missing', 'REMOVE(A)'),
+    ('remove placeholder', 'A = B\nB = 1\nREMOVE({A})'),
+    ('lower-case keyword', 'A = 1\nremove(A)'),
+    ('keyword as a value', 'A = FILE\nB = IMPORT'),
+    ('keyword as a name', 'IMPORT = 1\nFILE = 2'),
+    ('windows line endings', 'A = 1\r\nB = 2\r\n'),
+]
+
+# TFF strings that both parsers must reject:
+invalid_corpus = [
+    ('missing value', 'A = '),
+    ('missing name', '= 1'),
+    ('double equals', 'A == 1'),
+    ('trailing comma', 'A = 1,'),
+    ('missing comma', 'A = 1 2'),
+    ('unterminated quote', 'A = "1'),
+    ('mismatched quotes', 'A = "1\''),
+    ('parenthesised value', 'A = (1)'),
+    ('unclosed function', 'A = FILE(a'),
+    ('unclosed modifier', 'IMPORT(a'),
+    ('invalid character', 'A = 1;'),
+    ('unquoted space in name', 'A B = 1'),
+    ('unquoted backslash', r'A = a\b'),
+]
+
+class TFFParserConformanceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+    def writeFile(self, filename, content):
+        with open(filename, 'wt') as output_file: output_file.write(content)
+        return os.path.abspath(filename)
+    def tokens(self, token_set):
+        """Return the TokenSet as a list of (name, values) pairs, in definition order"""
+        return [(n, [str(v) for v in token_set[n].values]) for n in token_set.names]
+    def parse(self, method, *args):
+        """Parse the same input with both parsers, returning the pair of token lists"""
+        return [self.tokens(getattr(parser(), method)(*args)) for parser in (TFFParser, TFFLineParser)]
+    def assertConforms(self, method, *args):
+        expected, observed = self.parse(method, *args)
+        self.assertEqual(expected, observed)
+        return observed
+    def testValidStrings(self):
+        for name, tff in valid_corpus:
+            with self.subTest(name, tff=tff): self.assertConforms('parseString', tff)
+    def testInvalidStrings(self):
+        for name, tff in invalid_corpus:
+            for parser in (TFFParser, TFFLineParser):
+                with self.subTest(name, parser=parser.__name__, tff=tff):
+                    with self.assertRaises(TFFSyntaxError) as context: parser().parseString(tff)
+                    self.assertEqual(context.exception.line, tff.count('\n') + 1)
+    def testSyntaxErrorLine(self):
+        for parser in (TFFParser, TFFLineParser):
+            with self.assertRaises(TFFSyntaxError) as context: parser().parseString('A = 1\n# comment\nB = = 2\nC = 3')
+            self.assertEqual(context.exception.line, 3)
+            self.assertEqual(context.exception.text, 'B = = 2')
+    def testFile(self):
+        self.writeFile('values.txt', 'a\n\n# comment\nb\n')
+        tff = 'A = FILE(values.txt)\nB = SFILE("values.txt")\nC = file(values.txt) # comment\n'
+        self.assertEqual(self.assertConforms('parse', self.writeFile('main.tff', tff)), [('A', ['a', 'b']), ('B', ['a', '', '# comment', 'b']), ('C', ['a', 'b'])])
+    def testImport(self):
+        self.writeFile('common.tff', 'A = "common value"\nC = 3')
+        self.writeFile('first.tff', 'IMPORT(common.tff)\nB = 2')
+        self.writeFile('second.tff', "import('common.tff')\nA = {C}")
+        main = self.writeFile('main.tff', 'A = 1\nN = first, second\nIMPORT({N}.tff) # both files\n')
+        self.assertEqual(self.assertConforms('parse', main), [('A', ['{C}']), ('N', ['first', 'second']), ('C', ['3']), ('B', ['2'])])
+    def testImportCycle(self):
+        self.writeFile('a.tff', 'A = 1\nIMPORT(b.tff)')
+        self.writeFile('b.tff', 'B = 2\nIMPORT(a.tff)')
+        for parser in (TFFParser, TFFLineParser):
+            with self.subTest(parser=parser.__name__):
+                with self.assertRaises(TFFImportCycleError): parser().parse('a.tff')
+    def testMissingImport(self):
+        for parser in (TFFParser, TFFLineParser):
+            with self.subTest(parser=parser.__name__):
+                with self.assertRaises(FileNotFoundError): parser().parseString('IMPORT(missing.tff)')
+    def testImportSyntaxError(self):
+        self.writeFile('bad.tff', 'A = 1\nB = 2,')
+        for parser in (TFFParser, TFFLineParser):
+            with self.subTest(parser=parser.__name__):
+                with self.assertRaises(TFFSyntaxError) as context: parser().parseString('C = 3\nIMPORT(bad.tff)')
+                self.assertEqual(context.exception.line, 2)
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,45 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the TokenSet definition order"""
+
+import unittest
+from qsubsec.tokens import Token, TokenSet, TFFLineParser
+
+class TokenSetOrderTest(unittest.TestCase):
+    def tokenSet(self, *tokens):
+        token_set = TokenSet()
+        for name, values in tokens:
+            token = Token(name)
+            for value in values: token.add(value)
+            token_set.add(token)
+        return token_set
+    def testAddRemoveAdd(self):
+        token_set = self.tokenSet(('A', ['1']), ('B', ['2']), ('C', ['3']))
+        del(token_set['A'])
+        token_set.add(Token('D', values=['4']))
+        token_set.add(Token('E', values=['{D}{C}{B}']))
+        self.assertEqual(token_set.names, ['B', 'C', 'D', 'E'])
+        # Every token has a distinct position, in definition order:
+        self.assertEqual(sorted(token_set.names, key=token_set._positions.get), token_set.names)
+        self.assertEqual(len(set(token_set._positions.values())), 4)
+        self.assertEqual(token_set.getStringDependencies('{E}{X}'), ['B', 'C', 'D', 'E', 'X'])
+        # Redefining a token keeps its original position:
+        token_set.add(Token('C', values=['5']))
+        self.assertEqual(token_set.getStringDependencies('{E}'), ['B', 'C', 'D', 'E'])
+    def testRemoveCombinationOrder(self):
+        token_set = TFFLineParser().parseString('A = 1\nB = x, y\nC = 1, 2\nREMOVE(A)\nA = p, q\nD = "{A}{C}{B}"')
+        self.assertEqual(token_set.getStringDependencies('{D}'), ['B', 'C', 'A', 'D'])
+        self.assertEqual([t['D'].values[0] for t in token_set.iterResolve()], ['p1x', 'q1x', 'p2x', 'q2x', 'p1y', 'q1y', 'p2y', 'q2y'])
+
+if __name__ == '__main__': unittest.main()
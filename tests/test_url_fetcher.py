@@ -0,0 +1,181 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the URLFetcher against a local HTTP server"""
+
+import os
+import tempfile
+import time
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from unittest import mock
+from urllib.error import HTTPError
+from qsubsec.urlFetcher import URLFetcher
+
+class TestServer(ThreadingHTTPServer):
+    """A local HTTP/1.1 server recording the requests it receives"""
+    daemon_threads = True
+    def __init__(self):
+        super(TestServer, self).__init__(('127.0.0.1', 0), TestHandler)
+        self.lock = Lock()
+        self.requests = []
+        self.versions = {}
+        self.active = 0
+        self.max_active = 0
+    def url(self, path): return 'http://127.0.0.1:{}{}'.format(self.server_address[1], path)
+    def statuses(self, path): return [r[2] for r in self.requests if r[1] == path]
+
+class TestHandler(BaseHTTPRequestHandler):
+    """Serve versioned text resources with ETag or Last-Modified validators"""
+    protocol_version = 'HTTP/1.1'
+    def log_message(self, format, *args): pass
+    def respond(self, status, body=b'', headers={}):
+        with self.server.lock: self.server.requests.append((self.client_address, self.path, status))
+        self.send_response(status)
+        for name, value in headers.items(): self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try: self.handle_path()
+        finally:
+            with self.server.lock: self.server.active -= 1
+    def handle_path(self):
+        version = self.server.versions.get(self.path, 1)
+        body = '{} version {}\n'.format(self.path, version).encode('UTF-8')
+        if self.path.startswith('/etag/'):
+            etag = '"{}"'.format(version)
+            if self.headers.get('If-None-Match') == etag: return self.respond(304, headers={'ETag':etag})
+            return self.respond(200, body, {'ETag':etag})
+        if self.path.startswith('/modified/'):
+            modified = 'Mon, 0{} Jan 2024 00:00:00 GMT'.format(version)
+            if self.headers.get('If-Modified-Since') == modified: return self.respond(304, headers={'Last-Modified':modified})
+            return self.respond(200, body, {'Last-Modified':modified})
+        if self.path.startswith('/slow/'):
+            time.sleep(0.2)
+            return self.respond(200, body)
+        if self.path == '/redirect': return self.respond(302, headers={'Location':'/etag/target'})
+        if self.path.startswith('/plain/'): return self.respond(200, body)
+        return self.respond(404, b'not found')
+
+class URLFetcherTest(unittest.TestCase):
+    def setUp(self):
+        # Requests to the local server must not be sent through a proxy:
+        environment = mock.patch.dict(os.environ, {'no_proxy':'127.0.0.1', 'NO_PROXY':'127.0.0.1'})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.server = TestServer()
+        self.thread = Thread(target=self.server.serve_forever, kwargs={'poll_interval':0.05}, daemon=True)
+        self.thread.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'http')
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+    def fetcher(self, **kwargs):
+        fetcher = URLFetcher(**kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+    def testKeepAlive(self):
+        fetcher = self.fetcher()
+        for path in ('/plain/a', '/plain/b', '/etag/c', '/plain/d'):
+            self.assertEqual(fetcher.fetchText(self.server.url(path)), '{} version 1\n'.format(path))
+        self.assertEqual(len(self.server.requests), 4)
+        # All of the requests are made on a single connection:
+        self.assertEqual(len(set([r[0] for r in self.server.requests])), 1)
+    def testReconnect(self):
+        fetcher = self.fetcher()
+        fetcher.fetch(self.server.url('/plain/a'))
+        # Close the idle connection from the client side; the next request must open a new connection:
+        for idle in fetcher._connections.values():
+            for connection in idle: connection.sock.close()
+        self.assertEqual(fetcher.fetchText(self.server.url('/plain/b')), '/plain/b version 1\n')
+        self.assertEqual(len(set([r[0] for r in self.server.requests])), 2)
+    def testMemoryCache(self):
+        fetcher = self.fetcher()
+        url = self.server.url('/plain/a')
+        self.assertEqual(fetcher.fetch(url), fetcher.fetch(url))
+        self.assertEqual(len(self.server.requests), 1)
+        fetcher.clear()
+        fetcher.fetch(url)
+        self.assertEqual(len(self.server.requests), 2)
+    def testETagRevalidation(self):
+        url = self.server.url('/etag/a')
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).fetchText(url), '/etag/a version 1\n')
+        # A new fetcher revalidates the cached copy, and the server responds 304 Not Modified:
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).fetchText(url), '/etag/a version 1\n')
+        self.assertEqual(self.server.statuses('/etag/a'), [200, 304])
+        # Once the resource changes, the new version is downloaded:
+        self.server.versions['/etag/a'] = 2
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).fetchText(url), '/etag/a version 2\n')
+        self.assertEqual(self.server.statuses('/etag/a'), [200, 304, 200])
+    def testLastModifiedRevalidation(self):
+        url = self.server.url('/modified/a')
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).fetchText(url), '/modified/a version 1\n')
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).fetchText(url), '/modified/a version 1\n')
+        self.assertEqual(self.server.statuses('/modified/a'), [200, 304])
+        self.server.versions['/modified/a'] = 2
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).fetchText(url), '/modified/a version 2\n')
+        self.assertEqual(self.server.statuses('/modified/a'), [200, 304, 200])
+    def testUncachedResponses(self):
+        # Responses without validators are not cached, and nothing is cached without a cache path:
+        url = self.server.url('/plain/a')
+        self.fetcher(cache_path=self.cache_path).fetch(url)
+        self.fetcher(cache_path=self.cache_path).fetch(url)
+        self.fetcher().fetch(self.server.url('/etag/a'))
+        self.fetcher().fetch(self.server.url('/etag/a'))
+        self.assertEqual(self.server.statuses('/plain/a'), [200, 200])
+        self.assertEqual(self.server.statuses('/etag/a'), [200, 200])
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).clearCache(), 0)
+    def testClearCache(self):
+        url = self.server.url('/etag/a')
+        self.fetcher(cache_path=self.cache_path).fetch(url)
+        self.assertEqual(self.fetcher(cache_path=self.cache_path).clearCache(), 1)
+        self.fetcher(cache_path=self.cache_path).fetch(url)
+        self.assertEqual(self.server.statuses('/etag/a'), [200, 200])
+    def testRedirect(self):
+        self.assertEqual(self.fetcher().fetchText(self.server.url('/redirect')), '/etag/target version 1\n')
+        self.assertEqual([r[2] for r in self.server.requests], [302, 200])
+    def testHTTPError(self):
+        with self.assertRaises(HTTPError) as context: self.fetcher().fetch(self.server.url('/missing'))
+        self.assertEqual(context.exception.code, 404)
+    def testPrefetch(self):
+        fetcher = self.fetcher(jobs=4)
+        urls = [self.server.url('/slow/{}'.format(i)) for i in range(4)]
+        start = time.monotonic()
+        fetcher.prefetch(urls + urls[:2])
+        elapsed = time.monotonic() - start
+        # The URLs are fetched concurrently, and each only once:
+        self.assertGreater(self.server.max_active, 1)
+        self.assertLess(elapsed, 0.2 * len(urls))
+        self.assertEqual(len(self.server.requests), len(urls))
+        # Prefetched data is returned without further requests:
+        for i, url in enumerate(urls): self.assertEqual(fetcher.fetchText(url), '/slow/{} version 1\n'.format(i))
+        self.assertEqual(len(self.server.requests), len(urls))
+        # The prefetch connections are kept alive for reuse:
+        fetcher.fetch(self.server.url('/plain/a'))
+        self.assertIn(self.server.requests[-1][0], set([r[0] for r in self.server.requests[:-1]]))
+    def testPrefetchErrors(self):
+        fetcher = self.fetcher()
+        missing = self.server.url('/missing')
+        # Errors are ignored when prefetching, and raised when the URL is fetched:
+        fetcher.prefetch([self.server.url('/plain/a'), missing])
+        with self.assertRaises(HTTPError): fetcher.fetch(missing)
+        self.assertEqual(self.server.statuses('/plain/a'), [200])
+
+if __name__ == '__main__': unittest.main()